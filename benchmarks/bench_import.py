@@ -0,0 +1,55 @@
+"""
+Benchmark del caricamento di import_excel_cli.py: INSERT per riga e COPY
+
+Carica un DataFrame sintetico in inventario con insert_rows() e copy_rows()
+(trigger compresi) e annulla ogni caricamento con un rollback.
+
+Usage (dalla directory dell'applicazione):
+    python benchmarks/bench_import.py [numero di righe]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from import_excel_cli import (  # noqa: E402
+    copy_rows,
+    engine,
+    excel_to_db_fields,
+    insert_rows,
+)
+
+
+def synthetic_dataframe(n: int) -> pd.DataFrame:
+    rows = []
+    for i in range(n):
+        row = {column: f"{column} {i}" for column in excel_to_db_fields.values()}
+        row["rosso_fase_alimentazione_privilegiata"] = "false" if i % 2 else "true"
+        row["responsabile_laboratorio"] = f"ROSSI Mario {i % 50}" if i % 20 else ""
+        row["peso"] = str(i % 300)
+        row["dimensioni"] = f"{i % 200}x50x40"
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def bench(name: str, function, df: pd.DataFrame) -> None:
+    with engine.connect() as conn:
+        start = time.perf_counter()
+        function(conn, df)
+        elapsed = time.perf_counter() - start
+        conn.rollback()
+    print(
+        f"{name:7} {len(df)} righe in {elapsed:.2f} s ({len(df) / elapsed:.0f} righe/s)"
+    )
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    df = synthetic_dataframe(n_rows)
+
+    bench("INSERT", insert_rows, df)
+    bench("COPY", copy_rows, df)
@@ -0,0 +1,85 @@
+"""
+Benchmark dei motori di stampa delle etichette: typst (processo esterno) e fpdf2
+
+Confronta il tempo di creazione di un foglio di 50 etichette (massimo consentito
+da etichetta()) con record sintetici, senza cache e senza database.
+
+Usage (dalla directory dell'applicazione, serve client_secret.json):
+    python benchmarks/bench_labels.py [numero di ripetizioni]
+"""
+
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import togru  # noqa: E402
+
+N_LABELS = 50
+
+
+def synthetic_records(n: int) -> list[dict]:
+    return [
+        {
+            "id": 100000 + i,
+            "descrizione_bene": f"Centrifuga refrigerata da banco modello {i}",
+            "responsabile_laboratorio": f"ROSSI Mario {i % 7}",
+            "num_inventario": f"INV{i:05d}" if i % 5 else None,
+            "codice_sipi_torino": f"TO-{i:04d}",
+            "codice_sipi_grugliasco": f"GRU-{i:04d}" if i % 2 else None,
+            "da_movimentare": bool(i % 3),
+            "da_disinventariare": i % 11 == 0,
+            "trasporto_in_autonomia": i % 4 == 0,
+            "destinazione": "Laboratorio 2.14",
+        }
+        for i in range(n)
+    ]
+
+
+def typst(records) -> None:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        typst_path = Path(temp_dir) / "label.typst"
+        typst_path.write_text(togru.label_typst(records))
+        subprocess.run(
+            [
+                togru.app.config["TYPST_PATH"],
+                "compile",
+                typst_path,
+                Path(temp_dir) / "label.pdf",
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+
+def fpdf(records) -> None:
+    togru.label_fpdf(records)
+
+
+def bench(name: str, function, records, repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(records)
+        timings.append(time.perf_counter() - start)
+    print(
+        f"{name:6} {len(records)} etichette: "
+        f"mediana {statistics.median(timings) * 1000:.1f} ms, "
+        f"min {min(timings) * 1000:.1f} ms ({repeat} ripetizioni)"
+    )
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    records = synthetic_records(N_LABELS)
+
+    if Path(togru.app.config["TYPST_PATH"]).is_file():
+        bench("typst", typst, records, repeat)
+    else:
+        print(f"typst non trovato ({togru.app.config['TYPST_PATH']})")
+
+    bench("fpdf", fpdf, records, repeat)
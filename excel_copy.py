@@ -0,0 +1,89 @@
+"""
+Write the content of an XLSX file in the COPY text format of PostgreSQL
+
+Used by import_excel_cli_sql.py and import_excel_cli_sql_didattica.py (--format copy)
+"""
+
+import os
+import sys
+
+from openpyxl import load_workbook
+
+# colonne non di testo: una cella vuota è caricata come NULL (come in import_excel_cli.copy_rows)
+BOOLEAN_COLUMNS = ("rosso_fase_alimentazione_privilegiata",)
+
+
+def copy_value(value, null: bool = False) -> str:
+    """
+    convert a cell value in a field of the COPY text format
+
+    An empty cell is an empty string, or NULL (\\N) if null is True.
+    """
+    if value is None:
+        return "\\N" if null else ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def generate_copy(file_path, excel_to_db_fields, skip_columns=(), transform=None):
+    """
+    print a COPY ... FROM stdin block to load with psql
+
+    The first sheet of the workbook is read row by row (openpyxl read-only mode)
+    so the memory used does not depend on the size of the file.
+    skip_columns are read from the file but not loaded, transform(row) can
+    change the fields of a row before it is printed.
+    """
+    if not os.path.exists(file_path):
+        print(f"❌ File non trovato: {file_path}", file=sys.stderr)
+        return
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    rows = wb.worksheets[0].iter_rows(values_only=True)
+
+    header = [str(x).strip() if x is not None else "" for x in next(rows, ())]
+    # Eventuale rinomina colonna "Peso"
+    for idx, col in enumerate(header):
+        if col.startswith("Peso"):
+            header[idx] = "Peso"
+            break
+    header = [excel_to_db_fields.get(col, col) for col in header]
+
+    # Controllo colonne mancanti
+    expected_cols = list(excel_to_db_fields.values())
+    missing_cols = [c for c in expected_cols if c not in header]
+    if missing_cols:
+        print(f"❌ Mancano colonne nel file Excel: {missing_cols}", file=sys.stderr)
+        wb.close()
+        return
+
+    db_columns = [c for c in expected_cols if c not in skip_columns]
+    col_idx = {col: header.index(col) for col in expected_cols}
+
+    print(f"COPY inventario ({', '.join(db_columns)}) FROM stdin;")
+    n_rows = 0
+    for values in rows:
+        if all(x is None for x in values):
+            continue
+        row = {
+            col: copy_value(
+                values[idx] if idx < len(values) else None,
+                null=col in BOOLEAN_COLUMNS,
+            )
+            for col, idx in col_idx.items()
+        }
+        if transform is not None:
+            transform(row)
+        print("\t".join(row[col] for col in db_columns))
+        n_rows += 1
+    print("\\.")
+    wb.close()
+
+    print(f"✅ COPY generato con successo ({n_rows} righe)!", file=sys.stderr)
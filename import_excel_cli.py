@@ -1,6 +1,7 @@
+import argparse
 import pandas as pd
 from sqlalchemy import create_engine, text
-import sys
+import io
 import os
 
 # Configurazione database
@@ -32,8 +33,65 @@ excel_to_db_fields = {
     "Note": "note",
 }
 
-
-def upload_excel(file_path, user_email="cli_uploader"):
+# colonne booleane: una cella vuota è caricata come NULL
+BOOLEAN_COLUMNS = ("rosso_fase_alimentazione_privilegiata",)
+
+# righe inviate con ogni COPY
+COPY_CHUNK_SIZE = 10000
+
+
+def insert_rows(conn, df):
+    """
+    inserisce le righe con un INSERT per riga
+    """
+    sql = text("""
+        INSERT INTO inventario (
+            descrizione_inventario, num_inventario, num_inventario_ateneo, data_carico,
+            descrizione_bene, codice_sipi_torino, codice_sipi_grugliasco, destinazione,
+            rosso_fase_alimentazione_privilegiata, valore_convenzionale, esercizio_bene_migrato,
+            responsabile_laboratorio, denominazione_fornitore, anno_fabbricazione, numero_seriale,
+            categoria_inventoriale, catalogazione_materiale_strumentazione, peso, dimensioni,
+            ditta_costruttrice_fornitrice, note
+        ) VALUES (
+            :descrizione_inventario, :num_inventario, :num_inventario_ateneo, :data_carico,
+            :descrizione_bene, :codice_sipi_torino, :codice_sipi_grugliasco, :destinazione,
+            :rosso_fase_alimentazione_privilegiata, :valore_convenzionale, :esercizio_bene_migrato,
+            :responsabile_laboratorio, :denominazione_fornitore, :anno_fabbricazione, :numero_seriale,
+            :categoria_inventoriale, :catalogazione_materiale_strumentazione, :peso, :dimensioni,
+            :ditta_costruttrice_fornitrice, :note
+        )
+    """)
+    for _, row in df.iterrows():
+        conn.execute(sql, row.to_dict())
+
+
+def copy_rows(conn, df):
+    """
+    carica le righe con COPY FROM STDIN (formato CSV) a blocchi di COPY_CHUNK_SIZE righe
+
+    Le celle vuote delle colonne di testo sono caricate come stringa vuota
+    (FORCE_NOT_NULL), come con insert_rows.
+    """
+    columns = list(excel_to_db_fields.values())
+    text_columns = [c for c in columns if c not in BOOLEAN_COLUMNS]
+    sql = (
+        f"COPY inventario ({', '.join(columns)}) FROM STDIN "
+        f"WITH (FORMAT csv, FORCE_NOT_NULL ({', '.join(text_columns)}))"
+    )
+
+    # cursore psycopg2 nella stessa transazione della connessione SQLAlchemy
+    cursor = conn.connection.cursor()
+    for start in range(0, len(df), COPY_CHUNK_SIZE):
+        buffer = io.StringIO()
+        df[columns].iloc[start : start + COPY_CHUNK_SIZE].to_csv(
+            buffer, index=False, header=False
+        )
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+    cursor.close()
+
+
+def upload_excel(file_path, user_email="cli_uploader", copy=False):
     if not os.path.exists(file_path):
         print(f"❌ File non trovato: {file_path}")
         return
@@ -70,25 +128,10 @@ def upload_excel(file_path, user_email="cli_uploader"):
                 {"user": user_email},
             )
 
-            for _, row in df.iterrows():
-                sql = text("""
-                    INSERT INTO inventario (
-                        descrizione_inventario, num_inventario, num_inventario_ateneo, data_carico,
-                        descrizione_bene, codice_sipi_torino, codice_sipi_grugliasco, destinazione,
-                        rosso_fase_alimentazione_privilegiata, valore_convenzionale, esercizio_bene_migrato,
-                        responsabile_laboratorio, denominazione_fornitore, anno_fabbricazione, numero_seriale,
-                        categoria_inventoriale, catalogazione_materiale_strumentazione, peso, dimensioni,
-                        ditta_costruttrice_fornitrice, note
-                    ) VALUES (
-                        :descrizione_inventario, :num_inventario, :num_inventario_ateneo, :data_carico,
-                        :descrizione_bene, :codice_sipi_torino, :codice_sipi_grugliasco, :destinazione,
-                        :rosso_fase_alimentazione_privilegiata, :valore_convenzionale, :esercizio_bene_migrato,
-                        :responsabile_laboratorio, :denominazione_fornitore, :anno_fabbricazione, :numero_seriale,
-                        :categoria_inventoriale, :catalogazione_materiale_strumentazione, :peso, :dimensioni,
-                        :ditta_costruttrice_fornitrice, :note
-                    )
-                """)
-                conn.execute(sql, row.to_dict())
+            if copy:
+                copy_rows(conn, df)
+            else:
+                insert_rows(conn, df)
 
             conn.commit()
 
@@ -106,7 +149,14 @@ def upload_excel(file_path, user_email="cli_uploader"):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python upload_excel_cli.py <file_excel.xlsx>")
-    else:
-        upload_excel(sys.argv[1])
+    parser = argparse.ArgumentParser(description="Load an XLSX file into togru")
+    parser.add_argument("file", help="file_excel.xlsx")
+    parser.add_argument(
+        "--format",
+        choices=("insert", "copy"),
+        default="insert",
+        help="insert: one INSERT per row, copy: COPY ... FROM STDIN (faster for large files)",
+    )
+    args = parser.parse_args()
+
+    upload_excel(args.file, copy=args.format == "copy")
@@ -2,7 +2,9 @@
 Load content of an XLSX file and create SQL queries to load data into togru PostgreSQL DB
 """
 
+import argparse
 import pandas as pd
+from excel_copy import generate_copy
 import sys
 import os
 
@@ -76,9 +78,19 @@ def upload_excel_generate_sql(file_path):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(
-            "Usage: python import_excel_cli_sql.py <file_excel.xlsx>", file=sys.stderr
-        )
+    parser = argparse.ArgumentParser(
+        description="Create SQL statements to load an XLSX file into togru"
+    )
+    parser.add_argument("file", help="file_excel.xlsx")
+    parser.add_argument(
+        "--format",
+        choices=("insert", "copy"),
+        default="insert",
+        help="insert: one INSERT per row, copy: COPY ... FROM stdin (faster for large files)",
+    )
+    args = parser.parse_args()
+
+    if args.format == "copy":
+        generate_copy(args.file, excel_to_db_fields)
     else:
-        upload_excel_generate_sql(sys.argv[1])
+        upload_excel_generate_sql(args.file)
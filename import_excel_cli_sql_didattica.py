@@ -5,7 +5,9 @@ Add numero strumenti value before "Descrizione bene"
 
 """
 
+import argparse
 import pandas as pd
+from excel_copy import generate_copy
 import sys
 import os
 
@@ -87,10 +89,35 @@ def upload_excel_generate_sql(file_path):
         print(f"❌ Errore nella generazione SQL: {e}", file=sys.stderr)
 
 
+def numero_strumenti(row):
+    """
+    add the number of instruments before the description of the item
+    """
+    if row["numero_strumenti"] != "1":
+        row["descrizione_bene"] = (
+            f"Numero {row['numero_strumenti']} {row['descrizione_bene']}"
+        )
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(
-            "Usage: python import_excel_cli_sql.py <file_excel.xlsx>", file=sys.stderr
+    parser = argparse.ArgumentParser(
+        description="Create SQL statements to load an XLSX file into togru"
+    )
+    parser.add_argument("file", help="file_excel.xlsx")
+    parser.add_argument(
+        "--format",
+        choices=("insert", "copy"),
+        default="insert",
+        help="insert: one INSERT per row, copy: COPY ... FROM stdin (faster for large files)",
+    )
+    args = parser.parse_args()
+
+    if args.format == "copy":
+        generate_copy(
+            args.file,
+            excel_to_db_fields,
+            skip_columns=("numero_strumenti",),
+            transform=numero_strumenti,
         )
     else:
-        upload_excel_generate_sql(sys.argv[1])
+        upload_excel_generate_sql(args.file)
@@ -0,0 +1,65 @@
+-- Schema di base: inventario, users, locali
+--
+-- Le migrazioni sono eseguite in ordine di numero da
+--     flask --app togru migrate
+-- che registra le versioni applicate in schema_migrations.
+-- Ogni file è eseguito in una sola transazione; le istruzioni sono
+-- idempotenti (IF NOT EXISTS) per poter essere applicate anche ad un database
+-- creato prima delle migrazioni.
+
+CREATE TABLE IF NOT EXISTS inventario (
+    id SERIAL PRIMARY KEY,
+    descrizione_inventario TEXT,
+    num_inventario TEXT,
+    num_inventario_ateneo TEXT,
+    data_carico TEXT,
+    descrizione_bene TEXT,
+    codice_sipi_torino TEXT,
+    codice_sipi_grugliasco TEXT,
+    destinazione TEXT,
+    rosso_fase_alimentazione_privilegiata BOOLEAN,
+    valore_convenzionale TEXT,
+    esercizio_bene_migrato TEXT,
+    responsabile_laboratorio TEXT,
+    gruppo_ricerca TEXT,
+    denominazione_fornitore TEXT,
+    anno_fabbricazione TEXT,
+    numero_seriale TEXT,
+    categoria_inventoriale TEXT,
+    catalogazione_materiale_strumentazione TEXT,
+    peso TEXT,
+    dimensioni TEXT,
+    ditta_costruttrice_fornitrice TEXT,
+    note TEXT,
+    deleted TIMESTAMP,
+    microscopia BOOLEAN DEFAULT false,
+    catena_del_freddo BOOLEAN DEFAULT false,
+    alta_specialistica BOOLEAN DEFAULT false,
+    da_movimentare BOOLEAN DEFAULT false,
+    trasporto_in_autonomia BOOLEAN DEFAULT false,
+    da_disinventariare BOOLEAN DEFAULT false,
+    didattica BOOLEAN DEFAULT false,
+    quantita INTEGER DEFAULT 1,
+    collezione BOOLEAN DEFAULT false
+);
+
+-- colonna aggiunta dopo il primo dump dello schema
+ALTER TABLE inventario ADD COLUMN IF NOT EXISTS gruppo_ricerca TEXT;
+
+CREATE INDEX IF NOT EXISTS inventario_responsabile_idx ON inventario (responsabile_laboratorio);
+CREATE INDEX IF NOT EXISTS inventario_sipi_torino_idx ON inventario (codice_sipi_torino);
+
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email TEXT,
+    admin BOOLEAN
+);
+
+
+-- anagrafica dei locali (codici SIPI), usata da search_sipi_torino
+CREATE TABLE IF NOT EXISTS locali (
+    codice_sipi_torino TEXT,
+    denominazione TEXT,
+    utilizzo TEXT
+);
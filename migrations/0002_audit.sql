@@ -0,0 +1,97 @@
+-- Registro delle modifiche di inventario (inventario_audit)
+
+CREATE TABLE IF NOT EXISTS inventario_audit (
+    id SERIAL PRIMARY KEY,
+    operation_type TEXT NOT NULL, -- 'INSERT', 'UPDATE', 'DELETE'
+    record_id INTEGER, -- il campo id della tabella inventario
+    old_data JSONB,
+    new_data JSONB,
+    executed_by TEXT,
+    executed_at TIMESTAMP DEFAULT now()
+);
+
+-- colonna delle prime versioni, non valorizzata dal trigger
+ALTER TABLE inventario_audit DROP COLUMN IF EXISTS table_name;
+
+
+-- Trigger di audit a livello di statement (transition tables):
+-- una sola INSERT in inventario_audit per ogni statement su inventario.
+-- Per gli UPDATE sono registrati solo i campi modificati (old_data/new_data
+-- contengono le stesse chiavi); le righe non modificate non sono registrate.
+-- storico() ricostruisce i valori completi a partire dal record corrente.
+
+CREATE OR REPLACE FUNCTION log_inventario_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    username TEXT;
+BEGIN
+    -- Recupera il nome utente dalla variabile di sessione
+    username := current_setting('application_name', true);
+
+    -- Log INSERT
+    IF (TG_OP = 'INSERT') THEN
+        INSERT INTO inventario_audit (
+            operation_type, record_id, new_data, executed_by
+        )
+        SELECT 'INSERT', n.id, to_jsonb(n) - 'search_tsv', username
+        FROM new_rows n;
+    END IF;
+
+    -- Log UPDATE (solo i campi modificati)
+    IF (TG_OP = 'UPDATE') THEN
+        INSERT INTO inventario_audit (
+            operation_type, record_id, old_data, new_data, executed_by
+        )
+        SELECT 'UPDATE', n.id, diff.old_data, diff.new_data, username
+        FROM old_rows o
+        JOIN new_rows n ON n.id = o.id
+        CROSS JOIN LATERAL (
+            SELECT
+                jsonb_object_agg(old_field.key, old_field.value) AS old_data,
+                jsonb_object_agg(old_field.key, new_field.value) AS new_data
+            FROM jsonb_each(to_jsonb(o) - 'search_tsv') old_field
+            JOIN jsonb_each(to_jsonb(n) - 'search_tsv') new_field
+                ON new_field.key = old_field.key
+            WHERE old_field.value IS DISTINCT FROM new_field.value
+        ) diff
+        WHERE diff.old_data IS NOT NULL;
+    END IF;
+
+    -- Log DELETE
+    IF (TG_OP = 'DELETE') THEN
+        INSERT INTO inventario_audit (
+            operation_type, record_id, old_data, executed_by
+        )
+        SELECT 'DELETE', o.id, to_jsonb(o) - 'search_tsv', username
+        FROM old_rows o;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+
+-- una transition table può essere associata ad un solo evento: un trigger per evento
+DROP TRIGGER IF EXISTS inventario_audit_trigger ON inventario;
+DROP TRIGGER IF EXISTS inventario_audit_insert_trigger ON inventario;
+DROP TRIGGER IF EXISTS inventario_audit_update_trigger ON inventario;
+DROP TRIGGER IF EXISTS inventario_audit_delete_trigger ON inventario;
+
+CREATE TRIGGER inventario_audit_insert_trigger
+AFTER INSERT ON inventario
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_inventario_changes();
+
+CREATE TRIGGER inventario_audit_update_trigger
+AFTER UPDATE ON inventario
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_inventario_changes();
+
+CREATE TRIGGER inventario_audit_delete_trigger
+AFTER DELETE ON inventario
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION log_inventario_changes();
@@ -0,0 +1,37 @@
+-- Snapshot delle statistiche della home page
+--
+-- inventario_version viene incrementata (una volta per statement) ad ogni
+-- INSERT/UPDATE/DELETE su inventario. index() ricalcola le statistiche solo
+-- quando la versione del snapshot è diversa da quella corrente.
+
+CREATE TABLE IF NOT EXISTS inventario_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO inventario_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+
+CREATE TABLE IF NOT EXISTS inventario_stats (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL,
+    stats JSONB NOT NULL,
+    computed_at TIMESTAMP DEFAULT now()
+);
+
+
+CREATE OR REPLACE FUNCTION bump_inventario_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE inventario_version SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS inventario_version_trigger ON inventario;
+
+CREATE TRIGGER inventario_version_trigger
+AFTER INSERT OR UPDATE OR DELETE ON inventario
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_inventario_version();
@@ -0,0 +1,52 @@
+-- Colonne calcolate per peso, volume e conformità dei beni
+--
+-- Sostituiscono le espressioni regolari e i calcoli split_part() ripetuti
+-- in ogni query: sono mantenute da PostgreSQL ad ogni INSERT/UPDATE.
+
+ALTER TABLE inventario
+    ADD COLUMN IF NOT EXISTS peso_kg NUMERIC
+        GENERATED ALWAYS AS (
+            CASE WHEN peso ~ '^[0-9]+(\.[0-9]+)?$' THEN peso::numeric END
+        ) STORED,
+
+    ADD COLUMN IF NOT EXISTS volume_m3 NUMERIC
+        GENERATED ALWAYS AS (
+            CASE WHEN dimensioni ~ '^[0-9]+x[0-9]+x[0-9]+$' THEN
+                (split_part(dimensioni, 'x', 1))::numeric *
+                (split_part(dimensioni, 'x', 2))::numeric *
+                (split_part(dimensioni, 'x', 3))::numeric
+                / 1000000.0
+            END
+        ) STORED,
+
+    -- controlli solo per i beni da fare movimentare (non in autonomia), escluse le collezioni
+    ADD COLUMN IF NOT EXISTS peso_non_conforme BOOLEAN
+        GENERATED ALWAYS AS (
+            collezione = FALSE AND da_movimentare = TRUE AND trasporto_in_autonomia = FALSE
+            AND peso !~ '^-?[0-9]+(\.[0-9]+)?$'
+        ) STORED,
+
+    ADD COLUMN IF NOT EXISTS dimensioni_non_conforme BOOLEAN
+        GENERATED ALWAYS AS (
+            collezione = FALSE AND da_movimentare = TRUE AND trasporto_in_autonomia = FALSE
+            AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$'
+        ) STORED,
+
+    ADD COLUMN IF NOT EXISTS non_conforme BOOLEAN
+        GENERATED ALWAYS AS (
+            COALESCE(
+                collezione = FALSE AND da_movimentare = TRUE AND trasporto_in_autonomia = FALSE
+                AND (peso !~ '^-?[0-9]+(\.[0-9]+)?$' OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$'),
+                FALSE
+            )
+        ) STORED;
+
+
+CREATE INDEX IF NOT EXISTS inventario_non_conforme_idx
+    ON inventario (id)
+    WHERE non_conforme AND deleted IS NULL;
+
+-- totali di peso e volume dei beni da movimentare (index only scan)
+CREATE INDEX IF NOT EXISTS inventario_da_movimentare_idx
+    ON inventario (trasporto_in_autonomia) INCLUDE (quantita, peso_kg, volume_m3)
+    WHERE da_movimentare AND deleted IS NULL;
@@ -0,0 +1,6 @@
+-- Indice per la paginazione keyset di search() e tutti()
+-- (ordinamento per descrizione_bene, id)
+
+CREATE INDEX IF NOT EXISTS inventario_keyset_idx
+    ON inventario ((COALESCE(descrizione_bene, '')), id)
+    WHERE deleted IS NULL;
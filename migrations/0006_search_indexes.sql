@@ -0,0 +1,41 @@
+-- Indici per la ricerca testuale di search()
+--
+-- I filtri testuali diventano "campo ILIKE '%valore%'": gli indici GIN pg_trgm
+-- permettono di risolverli senza leggere tutta la tabella.
+-- search_tsv è il documento full-text (stemming italiano) usato dal parametro q.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS inventario_descrizione_bene_trgm_idx ON inventario USING gin (descrizione_bene gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_responsabile_laboratorio_trgm_idx ON inventario USING gin (responsabile_laboratorio gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_num_inventario_trgm_idx ON inventario USING gin (num_inventario gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_num_inventario_ateneo_trgm_idx ON inventario USING gin (num_inventario_ateneo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_data_carico_trgm_idx ON inventario USING gin (data_carico gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_codice_sipi_torino_trgm_idx ON inventario USING gin (codice_sipi_torino gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_codice_sipi_grugliasco_trgm_idx ON inventario USING gin (codice_sipi_grugliasco gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_destinazione_trgm_idx ON inventario USING gin (destinazione gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_denominazione_fornitore_trgm_idx ON inventario USING gin (denominazione_fornitore gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_anno_fabbricazione_trgm_idx ON inventario USING gin (anno_fabbricazione gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_numero_seriale_trgm_idx ON inventario USING gin (numero_seriale gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_categoria_inventoriale_trgm_idx ON inventario USING gin (categoria_inventoriale gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_catalogazione_materiale_strumentazione_trgm_idx ON inventario USING gin (catalogazione_materiale_strumentazione gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_ditta_costruttrice_fornitrice_trgm_idx ON inventario USING gin (ditta_costruttrice_fornitrice gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS inventario_note_trgm_idx ON inventario USING gin (note gin_trgm_ops);
+
+
+ALTER TABLE inventario
+    ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('italian', COALESCE(descrizione_bene, '')), 'A') ||
+            setweight(to_tsvector('italian',
+                COALESCE(catalogazione_materiale_strumentazione, '') || ' ' ||
+                COALESCE(categoria_inventoriale, '')), 'B') ||
+            setweight(to_tsvector('italian',
+                COALESCE(ditta_costruttrice_fornitrice, '') || ' ' ||
+                COALESCE(denominazione_fornitore, '') || ' ' ||
+                COALESCE(numero_seriale, '')), 'C') ||
+            setweight(to_tsvector('italian',
+                COALESCE(note, '') || ' ' || COALESCE(destinazione, '')), 'D')
+        ) STORED;
+
+CREATE INDEX IF NOT EXISTS inventario_search_tsv_idx ON inventario USING gin (search_tsv);
@@ -0,0 +1,12 @@
+-- Indice della documentazione fotografica
+--
+-- Una riga per ogni file <record_id>_<n>.<estensione> in static/images.
+-- Per indicizzare le foto già presenti: flask --app togru indicizza-foto
+
+CREATE TABLE IF NOT EXISTS foto (
+    record_id INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (record_id, n)
+);
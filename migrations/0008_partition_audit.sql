@@ -0,0 +1,123 @@
+-- Partizionamento mensile di inventario_audit
+--
+-- inventario_audit diventa una tabella partizionata per mese su executed_at
+-- (inventario_audit_AAAA_MM) con una partizione di default per le righe fuori
+-- dalle partizioni create. Gli indici (record_id, executed_at) e
+-- (executed_by, executed_at) servono a storico(), storico_utente() e
+-- attivita_utente().
+-- Le partizioni dei mesi successivi sono create da
+--     flask --app togru crea-partizioni-audit
+-- (da eseguire periodicamente, ad es. una volta al mese con cron).
+--
+-- Le righe esistenti (0002_audit.sql) sono spostate nelle partizioni.
+
+
+-- 1. tabella partizionata (la tabella esistente è rinominata in inventario_audit_old)
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'inventario_audit'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE inventario_audit RENAME TO inventario_audit_old;
+    ALTER TABLE inventario_audit_old RENAME CONSTRAINT inventario_audit_pkey TO inventario_audit_old_pkey;
+    -- la sequenza degli id è mantenuta (non deve essere eliminata con la vecchia tabella)
+    ALTER SEQUENCE inventario_audit_id_seq OWNED BY NONE;
+
+    CREATE TABLE inventario_audit (
+        id INTEGER NOT NULL DEFAULT nextval('inventario_audit_id_seq'),
+        operation_type TEXT NOT NULL, -- 'INSERT', 'UPDATE', 'DELETE'
+        record_id INTEGER, -- il campo id della tabella inventario
+        old_data JSONB,
+        new_data JSONB,
+        executed_by TEXT,
+        executed_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (id, executed_at)
+    ) PARTITION BY RANGE (executed_at);
+
+    ALTER SEQUENCE inventario_audit_id_seq OWNED BY inventario_audit.id;
+
+    CREATE TABLE inventario_audit_default PARTITION OF inventario_audit DEFAULT;
+END;
+$$;
+
+
+CREATE INDEX IF NOT EXISTS inventario_audit_record_id_idx
+    ON inventario_audit (record_id, executed_at);
+
+CREATE INDEX IF NOT EXISTS inventario_audit_executed_by_idx
+    ON inventario_audit (executed_by, executed_at);
+
+
+-- 2. creazione della partizione di un mese
+--    le righe del mese eventualmente finite nella partizione di default sono spostate
+CREATE OR REPLACE FUNCTION create_inventario_audit_partition(month DATE)
+RETURNS VOID AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month);
+    end_date DATE := date_trunc('month', month) + INTERVAL '1 month';
+    partition_name TEXT := 'inventario_audit_' || to_char(month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE inventario_audit INCLUDING DEFAULTS)', partition_name
+    );
+    EXECUTE format(
+        'WITH moved AS ('
+        '    DELETE FROM inventario_audit_default '
+        '    WHERE executed_at >= %L AND executed_at < %L RETURNING *'
+        ') INSERT INTO %I SELECT * FROM moved',
+        start_date, end_date, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE inventario_audit ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start_date, end_date
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- partizioni dal mese corrente ai months_ahead mesi successivi
+CREATE OR REPLACE FUNCTION create_inventario_audit_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM create_inventario_audit_partition(month::date)
+    FROM generate_series(
+        date_trunc('month', now()),
+        date_trunc('month', now()) + make_interval(months => months_ahead),
+        INTERVAL '1 month'
+    ) AS month;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- 3. spostamento delle righe esistenti
+DO $$
+BEGIN
+    IF to_regclass('inventario_audit_old') IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM create_inventario_audit_partition(month::date)
+    FROM generate_series(
+        (SELECT date_trunc('month', MIN(executed_at)) FROM inventario_audit_old),
+        (SELECT date_trunc('month', MAX(executed_at)) FROM inventario_audit_old),
+        INTERVAL '1 month'
+    ) AS month;
+
+    INSERT INTO inventario_audit (
+        id, operation_type, record_id, old_data, new_data, executed_by, executed_at
+    )
+    SELECT id, operation_type, record_id, old_data, new_data, executed_by,
+        COALESCE(executed_at, now())
+    FROM inventario_audit_old;
+
+    DROP TABLE inventario_audit_old;
+END;
+$$;
+
+
+SELECT create_inventario_audit_partitions(3);
@@ -0,0 +1,58 @@
+-- Riepilogo giornaliero delle operazioni registrate in inventario_audit
+--
+-- inventario_audit_daily (giorno, utente, tipo di operazione, numero) è
+-- aggiornata da un trigger a livello di statement ad ogni INSERT in
+-- inventario_audit: attivita_utenti() legge solo questa tabella.
+-- Le operazioni 'DELETED FOTO <nome file>' sono raggruppate in 'DELETED FOTO'.
+-- Le righe eliminate da inventario_audit (archiviazione) restano conteggiate.
+
+CREATE TABLE IF NOT EXISTS inventario_audit_daily (
+    day DATE NOT NULL,
+    executed_by TEXT NOT NULL, -- '' se l'utente non è registrato
+    operation_type TEXT NOT NULL,
+    num_operations INTEGER NOT NULL,
+    PRIMARY KEY (day, executed_by, operation_type)
+);
+
+
+CREATE OR REPLACE FUNCTION update_inventario_audit_daily()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO inventario_audit_daily AS d (day, executed_by, operation_type, num_operations)
+    SELECT
+        executed_at::date,
+        COALESCE(executed_by, ''),
+        CASE WHEN operation_type LIKE 'DELETED FOTO%' THEN 'DELETED FOTO' ELSE operation_type END,
+        COUNT(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, executed_by, operation_type)
+    DO UPDATE SET num_operations = d.num_operations + EXCLUDED.num_operations;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- trigger e ricalcolo del riepilogo nella stessa transazione (la migrazione):
+-- il lock impedisce nuove righe di audit durante il ricalcolo
+LOCK TABLE inventario_audit IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS inventario_audit_daily_trigger ON inventario_audit;
+
+CREATE TRIGGER inventario_audit_daily_trigger
+AFTER INSERT ON inventario_audit
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION update_inventario_audit_daily();
+
+TRUNCATE inventario_audit_daily;
+
+INSERT INTO inventario_audit_daily (day, executed_by, operation_type, num_operations)
+SELECT
+    executed_at::date,
+    COALESCE(executed_by, ''),
+    CASE WHEN operation_type LIKE 'DELETED FOTO%' THEN 'DELETED FOTO' ELSE operation_type END,
+    COUNT(*)
+FROM inventario_audit
+GROUP BY 1, 2, 3;
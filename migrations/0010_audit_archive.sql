@@ -0,0 +1,13 @@
+-- Archiviazione delle righe di inventario_audit più vecchie
+--
+-- flask --app togru archivia-audit sposta le righe dei mesi più vecchi di
+-- AUDIT_RETENTION_MONTHS in file JSONL compressi (uno per mese) in
+-- AUDIT_ARCHIVE_DIR ed elimina la partizione del mese.
+-- inventario_audit_archivio registra i mesi archiviati di ogni bene:
+-- storico() legge i file solo per i beni con righe archiviate.
+
+CREATE TABLE IF NOT EXISTS inventario_audit_archivio (
+    record_id INTEGER NOT NULL,
+    mese DATE NOT NULL,
+    PRIMARY KEY (record_id, mese)
+);
@@ -0,0 +1,21 @@
+-- Notifica delle modifiche di users
+--
+-- Ogni processo dell'applicazione mantiene in memoria gli utenti autorizzati
+-- (authorized_users) e resta in ascolto sul canale togru_users: la cache è
+-- invalidata al commit di ogni modifica di users.
+
+CREATE OR REPLACE FUNCTION notify_users_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('togru_users', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS users_notify_trigger ON users;
+
+CREATE TRIGGER users_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON users
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_users_changed();
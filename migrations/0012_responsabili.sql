@@ -0,0 +1,101 @@
+-- Anagrafica dei responsabili di laboratorio
+--
+-- inventario.responsabile_id fa riferimento a responsabili ed è mantenuto da
+-- un trigger BEFORE INSERT/UPDATE a partire da responsabile_laboratorio:
+-- il nome è ricondotto alla grafia registrata in responsabili (stessa chiave:
+-- maiuscole, spazi iniziali/finali e multipli ignorati), un nome nuovo è
+-- aggiunto a responsabili.
+-- Le varianti di grafia già presenti sono unificate nella grafia più usata.
+
+CREATE OR REPLACE FUNCTION responsabile_key(nome TEXT)
+RETURNS TEXT AS $$
+    SELECT upper(btrim(regexp_replace(COALESCE(nome, ''), '\s+', ' ', 'g')));
+$$ LANGUAGE sql IMMUTABLE;
+
+
+CREATE TABLE IF NOT EXISTS responsabili (
+    id SERIAL PRIMARY KEY,
+    nome TEXT NOT NULL,
+    chiave TEXT NOT NULL UNIQUE -- responsabile_key(nome)
+);
+
+ALTER TABLE inventario
+    ADD COLUMN IF NOT EXISTS responsabile_id INTEGER REFERENCES responsabili (id);
+
+CREATE INDEX IF NOT EXISTS inventario_responsabile_id_idx
+    ON inventario (responsabile_id)
+    WHERE deleted IS NULL;
+
+
+-- 1. un responsabile per chiave, con la grafia più usata
+INSERT INTO responsabili (nome, chiave)
+SELECT DISTINCT ON (responsabile_key(responsabile_laboratorio))
+    btrim(regexp_replace(responsabile_laboratorio, '\s+', ' ', 'g')),
+    responsabile_key(responsabile_laboratorio)
+FROM inventario
+WHERE responsabile_key(responsabile_laboratorio) <> ''
+GROUP BY responsabile_laboratorio
+ORDER BY responsabile_key(responsabile_laboratorio), COUNT(*) DESC, responsabile_laboratorio
+ON CONFLICT (chiave) DO NOTHING;
+
+
+-- 2. collegamento dei beni (non registrato in inventario_audit)
+ALTER TABLE inventario DISABLE TRIGGER inventario_audit_update_trigger;
+
+UPDATE inventario i
+SET responsabile_id = r.id
+FROM responsabili r
+WHERE r.chiave = responsabile_key(i.responsabile_laboratorio)
+    AND i.responsabile_id IS DISTINCT FROM r.id;
+
+ALTER TABLE inventario ENABLE TRIGGER inventario_audit_update_trigger;
+
+
+-- 3. unificazione delle varianti di grafia (registrata in inventario_audit)
+SET LOCAL application_name = 'migrate';
+
+UPDATE inventario i
+SET responsabile_laboratorio = r.nome
+FROM responsabili r
+WHERE i.responsabile_id = r.id
+    AND i.responsabile_laboratorio <> r.nome;
+
+
+-- 4. trigger per i nuovi beni e le modifiche
+CREATE OR REPLACE FUNCTION set_inventario_responsabile()
+RETURNS TRIGGER AS $$
+DECLARE
+    chiave_responsabile TEXT := responsabile_key(NEW.responsabile_laboratorio);
+    responsabile responsabili%ROWTYPE;
+BEGIN
+    IF chiave_responsabile = '' THEN
+        NEW.responsabile_id := NULL;
+        RETURN NEW;
+    END IF;
+
+    SELECT * INTO responsabile FROM responsabili WHERE chiave = chiave_responsabile;
+
+    IF NOT FOUND THEN
+        -- DO UPDATE per ottenere la riga anche se inserita da un'altra transazione
+        INSERT INTO responsabili (nome, chiave)
+        VALUES (
+            btrim(regexp_replace(NEW.responsabile_laboratorio, '\s+', ' ', 'g')),
+            chiave_responsabile
+        )
+        ON CONFLICT (chiave) DO UPDATE SET chiave = EXCLUDED.chiave
+        RETURNING * INTO responsabile;
+    END IF;
+
+    NEW.responsabile_id := responsabile.id;
+    NEW.responsabile_laboratorio := responsabile.nome;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP TRIGGER IF EXISTS inventario_responsabile_trigger ON inventario;
+
+CREATE TRIGGER inventario_responsabile_trigger
+BEFORE INSERT OR UPDATE OF responsabile_laboratorio ON inventario
+FOR EACH ROW
+EXECUTE FUNCTION set_inventario_responsabile();
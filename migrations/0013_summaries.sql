@@ -0,0 +1,84 @@
+-- Riepiloghi per gruppo di search_resp, search_gruppo_ricerca e search_sipi_torino
+--
+-- Una vista materializzata per raggruppamento, con numero di beni, beni non
+-- conformi, peso e volume dei beni da movimentare (come nella home page).
+-- Il gruppo "senza" è la riga con chiave 0 / ''.
+-- summary_rows() aggiorna la vista (REFRESH ... CONCURRENTLY, le letture non
+-- sono bloccate) quando inventario_version è cambiata dopo l'ultimo
+-- aggiornamento, registrato in inventario_summaries.
+
+CREATE TABLE IF NOT EXISTS inventario_summaries (
+    view_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT now()
+);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS inventario_per_responsabile AS
+SELECT
+    COALESCE(responsabile_id, 0) AS responsabile_id,
+    SUM(quantita) AS n_beni,
+    COUNT(*) FILTER (WHERE non_conforme) AS invalid_items_count,
+    ROUND(SUM(peso_kg * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    )) AS peso_totale,
+    ROUND(SUM(volume_m3 * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    ), 1) AS volume_totale
+FROM inventario
+WHERE deleted IS NULL
+GROUP BY 1;
+
+-- indice univoco necessario per REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS inventario_per_responsabile_idx
+    ON inventario_per_responsabile (responsabile_id);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS inventario_per_gruppo_ricerca AS
+SELECT
+    COALESCE(gruppo_ricerca, '') AS gruppo_ricerca,
+    SUM(quantita) AS n_beni,
+    COUNT(*) FILTER (WHERE non_conforme) AS invalid_items_count,
+    ROUND(SUM(peso_kg * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    )) AS peso_totale,
+    ROUND(SUM(volume_m3 * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    ), 1) AS volume_totale
+FROM inventario
+WHERE deleted IS NULL
+GROUP BY 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS inventario_per_gruppo_ricerca_idx
+    ON inventario_per_gruppo_ricerca (gruppo_ricerca);
+
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS inventario_per_sipi_torino AS
+SELECT
+    COALESCE(codice_sipi_torino, '') AS codice_sipi_torino,
+    SUM(quantita) AS n_beni,
+    COUNT(*) FILTER (WHERE non_conforme) AS invalid_items_count,
+    ROUND(SUM(peso_kg * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    )) AS peso_totale,
+    ROUND(SUM(volume_m3 * quantita) FILTER (
+        WHERE da_movimentare AND NOT trasporto_in_autonomia
+    ), 1) AS volume_totale
+FROM inventario
+WHERE deleted IS NULL
+GROUP BY 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS inventario_per_sipi_torino_idx
+    ON inventario_per_sipi_torino (codice_sipi_torino);
+
+
+-- le viste appena create corrispondono alla versione corrente
+INSERT INTO inventario_summaries (view_name, version)
+SELECT view_name, version
+FROM inventario_version,
+    unnest(ARRAY[
+        'inventario_per_responsabile',
+        'inventario_per_gruppo_ricerca',
+        'inventario_per_sipi_torino'
+    ]) AS view_name
+ON CONFLICT (view_name) DO UPDATE SET version = EXCLUDED.version, refreshed_at = now();
@@ -0,0 +1,33 @@
+-- Versione di inventario da una sequenza
+--
+-- L'UPDATE della riga di inventario_version ad ogni statement su inventario
+-- bloccava la riga fino al commit: le transazioni che scrivono su inventario
+-- erano messe in coda una dopo l'altra. nextval() non prende lock di riga.
+-- inventario_version diventa una vista sulla sequenza (stesse query di lettura).
+--
+-- nextval() non è transazionale: la versione cambia prima del commit della
+-- modifica. inventario_version() in togru.py considera definitiva una versione
+-- solo se nessuna transazione di scrittura era in corso dopo la sua lettura.
+
+CREATE SEQUENCE IF NOT EXISTS inventario_version_seq;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'inventario_version'::regclass) = 'r' THEN
+        PERFORM setval('inventario_version_seq', (SELECT version + 1 FROM inventario_version));
+        DROP TABLE inventario_version;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE VIEW inventario_version AS
+SELECT last_value AS version FROM inventario_version_seq;
+
+
+CREATE OR REPLACE FUNCTION bump_inventario_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval('inventario_version_seq');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
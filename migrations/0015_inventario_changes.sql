@@ -0,0 +1,64 @@
+-- Versione di inventario dalle transazioni di scrittura
+--
+-- La sequenza di 0014 cambiava prima del commit: togru.py non poteva sapere
+-- se i dati letti includevano già una modifica contata.
+-- Ogni transazione che scrive su inventario inserisce una riga (la sua xid) in
+-- inventario_changes: la riga è visibile solo dopo il commit, insieme alla
+-- modifica, e transazioni diverse inseriscono chiavi diverse (nessun lock di riga
+-- in comune).
+-- La versione è il numero di transazioni di scrittura concluse: righe di
+-- inventario_changes più quelle già compattate in inventario_changes_compacted
+-- (compact_inventario_changes(), dal comando aggiorna-riepiloghi).
+-- Letta nello stesso statement dei dati, corrisponde esattamente ai dati letti.
+
+CREATE TABLE IF NOT EXISTS inventario_changes (
+    xid XID8 PRIMARY KEY DEFAULT pg_current_xact_id(),
+    changed_at TIMESTAMP DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS inventario_changes_compacted (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    n BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO inventario_changes_compacted (id, n) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+
+CREATE OR REPLACE VIEW inventario_version AS
+SELECT
+    (SELECT n FROM inventario_changes_compacted)
+    + (SELECT COUNT(*) FROM inventario_changes) AS version;
+
+DROP SEQUENCE IF EXISTS inventario_version_seq;
+
+
+CREATE OR REPLACE FUNCTION bump_inventario_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- una riga per transazione (gli statement successivi non fanno nulla)
+    INSERT INTO inventario_changes DEFAULT VALUES ON CONFLICT (xid) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- le righe delle transazioni concluse prima di ogni snapshot in corso sono
+-- sostituite dal loro numero (la versione non cambia)
+CREATE OR REPLACE FUNCTION compact_inventario_changes()
+RETURNS BIGINT AS $$
+    WITH deleted AS (
+        DELETE FROM inventario_changes
+        WHERE xid < pg_snapshot_xmin(pg_current_snapshot())
+        RETURNING 1
+    )
+    UPDATE inventario_changes_compacted
+    SET n = n + (SELECT COUNT(*) FROM deleted)
+    RETURNING n;
+$$ LANGUAGE sql;
+
+
+-- le versioni registrate erano valori della sequenza: statistiche e riepiloghi
+-- sono ricalcolati alla prima richiesta
+DELETE FROM inventario_stats;
+
+UPDATE inventario_summaries SET version = -1;
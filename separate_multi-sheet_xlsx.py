@@ -2,40 +2,86 @@
 extract all sheets from an XLSX file and save them in a directory
 
 All spaces in sheet name are replaced by underscroe (_)
+
+The input file is read in read-only mode and every sheet is written by a
+separate process in write-only mode (rows are streamed, not kept in memory).
+
+Usage:
+    python separate_multi-sheet_xlsx.py <file_input.xlsx> <output_folder> [numero processi]
 """
 
 import openpyxl
 from openpyxl import Workbook
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import sys
+import time
 
-# Nome del file di partenza
-file_input = sys.argv[1]
-output_folder = sys.argv[2]
 
-# Crea la cartella di output se non esiste
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
+def split_sheet(
+    file_input: str, sheet_name: str, output_folder: str
+) -> tuple[str, int, float]:
+    """
+    save the sheet in a new XLSX file
 
-# Carica il file Excel
-wb = openpyxl.load_workbook(file_input)
+    return the output file, the number of rows and the elapsed time
+    """
+    start = time.perf_counter()
 
-# Per ogni foglio nel file originale
-for sheet_name in wb.sheetnames:
+    wb = openpyxl.load_workbook(file_input, read_only=True)
     sheet = wb[sheet_name]
 
     # Crea un nuovo workbook
-    new_wb = Workbook()
-    new_ws = new_wb.active
-    new_ws.title = sheet_name
+    new_wb = Workbook(write_only=True)
+    new_ws = new_wb.create_sheet(sheet_name)
 
-    # Copia i dati cella per cella
-    for row in sheet.iter_rows(values_only=False):
-        for cell in row:
-            new_ws[cell.coordinate].value = cell.value
+    # Copia i dati riga per riga
+    n_rows = 0
+    for row in sheet.iter_rows(values_only=True):
+        new_ws.append(row)
+        n_rows += 1
+    wb.close()
 
     # Salva il nuovo file
     output_file = os.path.join(output_folder, f"{sheet_name.replace(' ', '_')}.xlsx")
     new_wb.save(output_file)
 
-print(f"Salvati {len(wb.sheetnames)} file in '{output_folder}'")
+    return output_file, n_rows, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # Nome del file di partenza
+    file_input = sys.argv[1]
+    output_folder = sys.argv[2]
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    # Crea la cartella di output se non esiste
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    start = time.perf_counter()
+
+    # Legge solo i nomi dei fogli
+    wb = openpyxl.load_workbook(file_input, read_only=True)
+    sheetnames = wb.sheetnames
+    wb.close()
+
+    # Un foglio per processo
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                split_sheet, file_input, sheet_name, output_folder
+            ): sheet_name
+            for sheet_name in sheetnames
+        }
+        for n, future in enumerate(as_completed(futures), start=1):
+            output_file, n_rows, elapsed = future.result()
+            print(
+                f"[{n}/{len(sheetnames)}] {futures[future]}: "
+                f"{n_rows} righe in {elapsed:.2f} s -> {output_file}"
+            )
+
+    print(
+        f"Salvati {len(sheetnames)} file in '{output_folder}' "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
@@ -2,19 +2,36 @@
 Servizio To-Gru (inventario per traslocco)
 """
 
+import gzip
+import hashlib
 import json
 import os
+import select
 import subprocess
+import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from decimal import Decimal
 from functools import wraps
 from io import BytesIO
 from pathlib import Path
+from urllib.parse import parse_qs
 
+import click
 import pandas as pd
+import psycopg2
+import segno
+import xlsxwriter
 from flask import (
     Flask,
+    abort,
     flash,
+    g,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -22,9 +39,12 @@ from flask import (
     session,
     url_for,
 )
+from fpdf import FPDF
+from fpdf.enums import RenderStyle
 from markupsafe import Markup
+from PIL import Image, ImageOps
 from requests_oauthlib import OAuth2Session
-from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy import create_engine, event, text
 
 # from werkzeug.utils import secure_filename
 
@@ -36,7 +56,11 @@ app = Flask(__name__, static_url_path=f"{APP_ROOT}/static")
 
 
 DATABASE_URL = "postgresql://togru_user@localhost:5432/togru"
-engine = create_engine(DATABASE_URL)
+
+# migrazioni dello schema (flask --app togru migrate)
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+# chiave dell'advisory lock che impedisce due migrate contemporanei
+MIGRATIONS_LOCK_KEY = 7460921
 
 # Carico le credenziali dal JSON
 try:
@@ -60,17 +84,223 @@ try:
     if "127.0.0.1" in redirect_uri:
         os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
     app.config["UPLOAD_FOLDER"] = "static/images"
+    # lato massimo (pixel) delle foto originali caricate
+    app.config["PHOTO_MAX_SIZE"] = int(
+        os.environ.get("TOGRU_PHOTO_MAX_SIZE") or config.get("photo_max_size") or 2560
+    )
     app.config["TYPST_PATH"] = (
         os.environ.get("TOGRU_TYPST_PATH")
         or config.get("typst_path")
         or "/usr/bin/typst"
     )
+    # motore per la stampa delle etichette: typst (processo esterno) o fpdf
+    app.config["LABEL_BACKEND"] = (
+        os.environ.get("TOGRU_LABEL_BACKEND") or config.get("label_backend") or "typst"
+    )
+    # cache delle etichette (indicizzate con l'hash del sorgente typst)
+    app.config["LABEL_CACHE_DIR"] = (
+        os.environ.get("TOGRU_LABEL_CACHE_DIR")
+        or config.get("label_cache_dir")
+        or "/tmp/togru_labels"
+    )
+    # numero massimo di file (SVG delle etichette e PDF) conservati nella cache
+    app.config["LABEL_CACHE_SIZE"] = int(
+        os.environ.get("TOGRU_LABEL_CACHE_SIZE")
+        or config.get("label_cache_size")
+        or 500
+    )
+    # numero di beni per pagina in search() e tutti()
+    app.config["PAGE_SIZE"] = int(
+        os.environ.get("TOGRU_PAGE_SIZE") or config.get("page_size") or 200
+    )
+    # pool di connessioni al database (per processo gunicorn):
+    # al massimo DB_POOL_SIZE + DB_MAX_OVERFLOW connessioni per worker
+    app.config["DB_POOL_SIZE"] = int(
+        os.environ.get("TOGRU_DB_POOL_SIZE") or config.get("db_pool_size") or 5
+    )
+    app.config["DB_MAX_OVERFLOW"] = int(
+        os.environ.get("TOGRU_DB_MAX_OVERFLOW") or config.get("db_max_overflow") or 10
+    )
+    # verifica la connessione prima dell'uso (riavvio di PostgreSQL)
+    app.config["DB_POOL_PRE_PING"] = str(
+        os.environ.get("TOGRU_DB_POOL_PRE_PING") or config.get("db_pool_pre_ping", True)
+    ).lower() in ("1", "true", "yes")
+    # secondi dopo i quali una connessione è ricreata (-1: mai)
+    app.config["DB_POOL_RECYCLE"] = int(
+        os.environ.get("TOGRU_DB_POOL_RECYCLE") or config.get("db_pool_recycle") or 1800
+    )
+    # secondi dopo i quali la cache degli utenti è comunque riletta
+    # (normalmente è invalidata subito con LISTEN/NOTIFY, vedi authorized_users)
+    app.config["USERS_CACHE_TTL"] = int(
+        os.environ.get("TOGRU_USERS_CACHE_TTL") or config.get("users_cache_ttl") or 300
+    )
+    # archivio delle righe di inventario_audit (vedi migrations/0010_audit_archive.sql)
+    app.config["AUDIT_ARCHIVE_DIR"] = (
+        os.environ.get("TOGRU_AUDIT_ARCHIVE_DIR")
+        or config.get("audit_archive_dir")
+        or "audit_archive"
+    )
+    # mesi di audit mantenuti nel database
+    app.config["AUDIT_RETENTION_MONTHS"] = int(
+        os.environ.get("TOGRU_AUDIT_RETENTION_MONTHS")
+        or config.get("audit_retention_months")
+        or 24
+    )
 
 
 except Exception:
     raise
 
 
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=app.config["DB_POOL_SIZE"],
+    max_overflow=app.config["DB_MAX_OVERFLOW"],
+    pool_pre_ping=app.config["DB_POOL_PRE_PING"],
+    pool_recycle=app.config["DB_POOL_RECYCLE"],
+)
+
+# statistiche del pool di connessioni del processo (vedi pool_metrics)
+pool_stats = {
+    "connects": 0,
+    "checkouts": 0,
+    "invalidated": 0,
+    "checkout_wait_total": 0.0,
+    "checkout_wait_max": 0.0,
+}
+
+
+@event.listens_for(engine, "connect")
+def count_connect(dbapi_connection, connection_record):
+    pool_stats["connects"] += 1
+
+
+@event.listens_for(engine, "checkout")
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats["checkouts"] += 1
+
+
+@event.listens_for(engine, "invalidate")
+def count_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats["invalidated"] += 1
+
+
+def get_db():
+    """
+    return the database connection of the request
+
+    The connection is taken from the pool at the first use and returned at the
+    end of the request (close_db).
+    """
+    if "db" not in g:
+        start = time.perf_counter()
+        g.db = engine.connect()
+        wait = time.perf_counter() - start
+        pool_stats["checkout_wait_total"] += wait
+        pool_stats["checkout_wait_max"] = max(pool_stats["checkout_wait_max"], wait)
+    return g.db
+
+
+@contextmanager
+def db_connection():
+    """
+    use the connection of the request (get_db) in a with block
+
+    As with engine.connect(), a transaction not committed in the block is
+    rolled back at the end of the block.
+    """
+    conn = get_db()
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction():
+            conn.rollback()
+
+
+@app.teardown_appcontext
+def close_db(exception):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+
+# cache degli utenti autorizzati del processo (email -> admin)
+# "generation" è incrementato ad ogni invalidazione
+users_cache = {"users": None, "loaded_at": 0.0, "generation": 0}
+users_listener = {"pid": None, "lock": threading.Lock()}
+
+
+def invalidate_users_cache():
+    users_cache["generation"] += 1
+    users_cache["users"] = None
+
+
+def listen_users_changes():
+    """
+    invalidate the users cache when the users table changes
+
+    Runs in a thread of every worker process with a dedicated connection
+    listening on the togru_users channel (see migrations/0011_users_notify.sql).
+    """
+    while True:
+        try:
+            listen_conn = psycopg2.connect(DATABASE_URL)
+            listen_conn.autocommit = True
+            with listen_conn.cursor() as cursor:
+                cursor.execute("LISTEN togru_users")
+            # le notifiche perse durante la riconnessione
+            invalidate_users_cache()
+            while True:
+                if select.select([listen_conn], [], [], 60) == ([], [], []):
+                    continue
+                listen_conn.poll()
+                if listen_conn.notifies:
+                    listen_conn.notifies.clear()
+                    invalidate_users_cache()
+        except Exception:
+            app.logger.exception("Errore della connessione LISTEN togru_users")
+            invalidate_users_cache()
+            time.sleep(5)
+
+
+def authorized_users() -> dict[str, bool]:
+    """
+    return the authorized users (email -> admin) from the cache of the process
+
+    The cache is reloaded after a change of the users table (LISTEN/NOTIFY)
+    or after USERS_CACHE_TTL seconds.
+    """
+    # il thread è avviato nel processo del worker (dopo il fork di gunicorn)
+    if users_listener["pid"] != os.getpid():
+        with users_listener["lock"]:
+            if users_listener["pid"] != os.getpid():
+                threading.Thread(
+                    target=listen_users_changes, name="users-listener", daemon=True
+                ).start()
+                users_listener["pid"] = os.getpid()
+
+    users = users_cache["users"]
+    if (
+        users is None
+        or time.monotonic() - users_cache["loaded_at"] > app.config["USERS_CACHE_TTL"]
+    ):
+        generation = users_cache["generation"]
+        with db_connection() as conn:
+            users = dict(
+                conn.execute(
+                    text(
+                        "SELECT email, COALESCE(admin, FALSE) FROM users "
+                        "WHERE email IS NOT NULL"
+                    )
+                ).all()
+            )
+        # non salvata se invalidata durante la lettura
+        if users_cache["generation"] == generation:
+            users_cache.update(users=users, loaded_at=time.monotonic())
+
+    return users
+
+
 BOOLEAN_FIELDS = [
     "microscopia",
     "catena_del_freddo",
@@ -106,6 +336,51 @@ CHOICE_FIELDS = {
 }
 
 
+# campi del form di ricerca
+SEARCH_FIELDS = [
+    # "descrizione_inventario",
+    "descrizione_bene",
+    "responsabile_laboratorio",
+    "gruppo_ricerca",
+    "collezione",
+    "num_inventario",
+    "num_inventario_ateneo",
+    "data_carico",
+    "codice_sipi_torino",
+    "codice_sipi_grugliasco",
+    "destinazione",
+    "microscopia",
+    "catena_del_freddo",
+    "alta_specialistica",
+    "da_movimentare",
+    "trasporto_in_autonomia",
+    "da_disinventariare",
+    "rosso_fase_alimentazione_privilegiata",
+    "didattica",
+    # "valore_convenzionale",
+    # "esercizio_bene_migrato",
+    "denominazione_fornitore",
+    "anno_fabbricazione",
+    "numero_seriale",
+    "categoria_inventoriale",
+    "catalogazione_materiale_strumentazione",
+    # "peso",
+    # "dimensioni",
+    "ditta_costruttrice_fornitrice",
+    "note",
+]
+
+
+# varianti WebP delle foto (lato massimo in pixel), in UPLOAD_FOLDER/varianti
+PHOTO_VARIANTS = {
+    "thumb": 320,
+    "preview": 1280,
+}
+
+# elaborazione delle foto fuori dal thread della richiesta
+photo_executor = ThreadPoolExecutor(max_workers=2)
+
+
 def normalize_gruppo_ricerca(value: str | None) -> str | None:
     value = (value or "").strip().upper()
     if value in ("", "NULL", "SENZA"):
@@ -118,47 +393,19 @@ def normalize_gruppo_ricerca(value: str | None) -> str | None:
     return value
 
 
-# Creazione tabella
-with engine.connect() as conn:
-    _ = conn.execute(
-        text("""
-        CREATE TABLE IF NOT EXISTS inventario (
-            id SERIAL PRIMARY KEY,
-            descrizione_inventario TEXT,
-            num_inventario TEXT,
-            num_inventario_ateneo TEXT,
-            data_carico TEXT,
-            descrizione_bene TEXT,
-            codice_sipi_torino TEXT,
-            codice_sipi_grugliasco TEXT,
-            destinazione TEXT,
-            rosso_fase_alimentazione_privilegiata TEXT,
-            didattica boolean default false,
-            valore_convenzionale TEXT,
-            esercizio_bene_migrato TEXT,
-            responsabile_laboratorio TEXT,
-            gruppo_ricerca TEXT,
-            denominazione_fornitore TEXT,
-            anno_fabbricazione TEXT,
-            numero_seriale TEXT,
-            categoria_inventoriale TEXT,
-            catalogazione_materiale_strumentazione TEXT,
-            peso TEXT,
-            dimensioni TEXT,
-            ditta_costruttrice_fornitrice TEXT,
-            note TEXT,
-    deleted TIMESTAMP DEFAULT NULL
-        )
-    """)
-    )
-    conn.commit()
-
-
 def check_login(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if "email" not in session:
             return redirect(url_for("login"))
+        users = authorized_users()
+        # utente rimosso dopo il login
+        if session["email"] not in users:
+            session.clear()
+            flash("Non sei più autorizzato ad accedere", "danger")
+            return redirect(url_for("index"))
+        if session.get("admin") != users[session["email"]]:
+            session["admin"] = users[session["email"]]
         return f(*args, **kwargs)
 
     return decorated_function
@@ -167,17 +414,222 @@ def check_login(f):
 def check_admin(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        with engine.connect() as conn:
-            if "email" not in session:
-                return redirect(url_for("index"))
-            if session.get("admin", False):
-                return f(*args, **kwargs)
-            else:
-                return redirect(url_for("index"))
+        if "email" not in session:
+            return redirect(url_for("index"))
+        if authorized_users().get(session["email"], False):
+            return f(*args, **kwargs)
+        else:
+            return redirect(url_for("index"))
 
     return decorated_function
 
 
+def active_responsabili(conn) -> list:
+    """
+    returns the responsabili of the records (see migrations/0012_responsabili.sql)
+    """
+    return conn.execute(
+        text(
+            "SELECT id, nome FROM responsabili r "
+            "WHERE EXISTS ("
+            "  SELECT 1 FROM inventario "
+            "  WHERE responsabile_id = r.id AND deleted IS NULL"
+            ") "
+            "ORDER BY nome"
+        )
+    ).fetchall()
+
+
+def form_responsabile(conn, form) -> str:
+    """
+    returns the name of the responsabile chosen in the form of a record
+
+    The form posts the responsabile_id ("altro" for a new responsabile typed in
+    nuovo_responsabile_laboratorio): the name is the one registered in responsabili
+    and the trigger of migrations/0012_responsabili.sql sets the same responsabile_id.
+    raise ValueError if the responsabile_id is not valid
+    """
+    value = form.get("responsabile_id", "")
+    if value == "altro":
+        return form.get("nuovo_responsabile_laboratorio", "").strip()
+    if not value:
+        return ""
+    nome = None
+    if value.isdigit():
+        nome = conn.execute(
+            text("SELECT nome FROM responsabili WHERE id = :id"), {"id": int(value)}
+        ).scalar()
+    if nome is None:
+        raise ValueError("Responsabile non valido")
+    return nome
+
+
+def record_photos(conn, record_id: int) -> list[str]:
+    """
+    returns the file names of the photos of a record (see migrations/0007_foto.sql)
+    """
+    return list(
+        conn.execute(
+            text("SELECT filename FROM foto WHERE record_id = :record_id ORDER BY n"),
+            {"record_id": record_id},
+        ).scalars()
+    )
+
+
+def first_photos(conn, ids: list[int]) -> dict[int, str]:
+    """
+    returns the file name of the first photo of every record in ids
+    """
+    if not ids:
+        return {}
+    return dict(
+        conn.execute(
+            text(
+                "SELECT DISTINCT ON (record_id) record_id, filename FROM foto "
+                "WHERE record_id = ANY(:ids) "
+                "ORDER BY record_id, n"
+            ),
+            {"ids": ids},
+        ).fetchall()
+    )
+
+
+def save_photo(conn, record_id: int, foto) -> str:
+    """
+    save the uploaded photo as <record_id>_<n>.<ext> in the UPLOAD_FOLDER
+
+    The number n is allocated in the foto table while holding a lock on the
+    record id so concurrent uploads cannot get the same file name.
+    The transaction is committed.
+    """
+    _ = conn.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext('foto'), :record_id)"),
+        {"record_id": record_id},
+    )
+    filename = conn.execute(
+        text(
+            "INSERT INTO foto (record_id, n, filename) "
+            "SELECT :record_id, n, CONCAT(:record_id, '_', n, :suffix) "
+            "FROM (SELECT COALESCE(MAX(n), 0) + 1 AS n FROM foto WHERE record_id = :record_id) AS next "
+            "RETURNING filename"
+        ),
+        {"record_id": record_id, "suffix": Path(foto.filename).suffix},
+    ).scalar()
+
+    foto.save(Path(app.config["UPLOAD_FOLDER"]) / filename)
+    conn.commit()
+
+    _ = photo_executor.submit(
+        process_photo, Path(app.config["UPLOAD_FOLDER"]) / filename
+    )
+
+    return filename
+
+
+def variant_path(filename: str, variant: str) -> Path:
+    """
+    path of a WebP variant of a photo
+    """
+    return (
+        Path(app.config["UPLOAD_FOLDER"])
+        / "varianti"
+        / f"{Path(filename).stem}.{variant}.webp"
+    )
+
+
+@app.template_global()
+def photo_variant(filename: str, variant: str) -> str:
+    """
+    static path of the variant of a photo, of the original if the variant is not ready
+    """
+    if variant_path(filename, variant).exists():
+        return f"images/varianti/{variant_path(filename, variant).name}"
+    return f"images/{filename}"
+
+
+def process_photo(file_path: Path) -> None:
+    """
+    downscale the original photo to PHOTO_MAX_SIZE and create the WebP variants
+    """
+    max_size: int = app.config["PHOTO_MAX_SIZE"]
+    try:
+        with Image.open(file_path) as original:
+            # le foto dei telefoni sono spesso JPEG con più immagini (MPO):
+            # salvate come JPEG con la sola immagine principale
+            img_format = (
+                "JPEG" if original.format in ("JPEG", "MPO") else original.format
+            )
+            img = ImageOps.exif_transpose(original)
+
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size))
+            if img_format == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+            temp_path = file_path.with_name(f".{file_path.name}")
+            img.save(temp_path, format=img_format, quality=85)
+            temp_path.replace(file_path)
+
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+        for variant, size in PHOTO_VARIANTS.items():
+            path = variant_path(file_path.name, variant)
+            path.parent.mkdir(exist_ok=True)
+            resized = img.copy()
+            resized.thumbnail((size, size))
+            temp_path = path.with_name(f".{path.name}")
+            resized.save(temp_path, format="WEBP", quality=80)
+            temp_path.replace(path)
+
+    except Exception:
+        app.logger.exception(f"Errore nell'elaborazione della foto {file_path}")
+
+
+@app.cli.command("genera-varianti")
+def generate_variants():
+    """
+    create the missing WebP variants of the indexed photos
+    """
+    with engine.connect() as conn:
+        filenames = conn.execute(text("SELECT filename FROM foto")).scalars().all()
+
+    n = 0
+    for filename in filenames:
+        if not all(variant_path(filename, v).exists() for v in PHOTO_VARIANTS) and (
+            (Path(app.config["UPLOAD_FOLDER"]) / filename).exists()
+        ):
+            process_photo(Path(app.config["UPLOAD_FOLDER"]) / filename)
+            n += 1
+
+    print(f"{n} foto elaborate")
+
+
+@app.cli.command("indicizza-foto")
+def index_photos():
+    """
+    rebuild the foto table from the files in the UPLOAD_FOLDER
+    """
+    files = {}
+    for file_path in Path(app.config["UPLOAD_FOLDER"]).glob("*_*.*"):
+        record_id, _, n = file_path.stem.partition("_")
+        if record_id.isdigit() and n.isdigit():
+            files[(int(record_id), int(n))] = file_path.name
+
+    with engine.connect() as conn:
+        _ = conn.execute(text("DELETE FROM foto"))
+        for (record_id, n), filename in files.items():
+            _ = conn.execute(
+                text(
+                    "INSERT INTO foto (record_id, n, filename) "
+                    "VALUES (:record_id, :n, :filename)"
+                ),
+                {"record_id": record_id, "n": n, "filename": filename},
+            )
+        conn.commit()
+
+    print(f"{len(files)} foto indicizzate")
+
+
 # Aggiungi record
 @app.route(APP_ROOT + "/aggiungi", methods=["GET", "POST"])
 @app.route(APP_ROOT + "/aggiungi/", methods=["GET", "POST"])
@@ -188,17 +640,17 @@ def aggiungi(query_string: str = ""):
     aggiungi bene all'inventario
     """
     if request.method == "GET":
-        with engine.connect() as conn:
-            responsabili = conn.execute(
-                text(
-                    "SELECT DISTINCT responsabile_laboratorio FROM inventario WHERE deleted IS NULL ORDER BY responsabile_laboratorio"
-                )
-            ).fetchall()
-
-        search_responsabile = "None"
-        if query_string:
-            search_responsabile = query_string.split("=")[1].replace("+", " ")
-            print(f"{search_responsabile=}")
+        with db_connection() as conn:
+            responsabili = active_responsabili(conn)
+
+        # responsabile della ricerca di provenienza
+        search_args = parse_qs(query_string)
+        search_responsabile_id = None
+        for responsabile in responsabili:
+            if search_args.get("responsabile_id") == [str(responsabile.id)] or (
+                search_args.get("responsabile_laboratorio") == [responsabile.nome]
+            ):
+                search_responsabile_id = responsabile.id
 
         return render_template(
             "aggiungi.html",
@@ -206,7 +658,7 @@ def aggiungi(query_string: str = ""):
             boolean_fields=BOOLEAN_FIELDS,
             choice_fields=CHOICE_FIELDS,
             query_string=query_string,
-            search_responsabile=search_responsabile,
+            search_responsabile_id=search_responsabile_id,
         )
 
     if request.method == "POST":
@@ -217,14 +669,12 @@ def aggiungi(query_string: str = ""):
             value = request.form.get(field)
             data[field] = value == "true"
 
-        # check for new responsabile
-        if data["responsabile_laboratorio"] == "altro":
-            data["responsabile_laboratorio"] = data["nuovo_responsabile_laboratorio"]
-
         try:
             data["gruppo_ricerca"] = normalize_gruppo_ricerca(
                 data.get("gruppo_ricerca")
             )
+            with db_connection() as conn:
+                data["responsabile_laboratorio"] = form_responsabile(conn, request.form)
         except ValueError as exc:
             flash(str(exc), "danger")
             return redirect(request.referrer or url_for("aggiungi"))
@@ -251,7 +701,7 @@ def aggiungi(query_string: str = ""):
             )
             RETURNING id
         """)
-        with engine.connect() as conn:
+        with db_connection() as conn:
             _ = conn.execute(
                 text("SET LOCAL application_name = :user"), {"user": session["email"]}
             )
@@ -261,10 +711,7 @@ def aggiungi(query_string: str = ""):
             # foto
             foto = request.files.get("foto")
             if foto and foto.filename != "":
-                foto.save(
-                    Path(app.config["UPLOAD_FOLDER"])
-                    / Path(str(new_id) + "_1").with_suffix(Path(foto.filename).suffix)
-                )
+                _ = save_photo(conn, new_id, foto)
 
         if query_string:
             return redirect(APP_ROOT + f"/search?{query_string}")
@@ -280,7 +727,7 @@ def aggiungi_user():
     add a user
     """
     if request.method == "GET":
-        with engine.connect() as conn:
+        with db_connection() as conn:
             users = conn.execute(
                 text(
                     "SELECT email, INITCAP(REPLACE(REPLACE(email, '@unito.it', ''), '.', ' ')) AS name FROM users ORDER by email"
@@ -291,7 +738,7 @@ def aggiungi_user():
 
     if request.method == "POST":
         email = request.form.get("email")
-        with engine.connect() as conn:
+        with db_connection() as conn:
             # text if user already present
             sql = text("SELECT COUNT(*) FROM users WHERE email = :email")
             if conn.execute(sql, {"email": email}).scalar():
@@ -301,6 +748,8 @@ def aggiungi_user():
             sql = text("INSERT INTO users (email, admin) VALUES (:email, :admin)")
             _ = conn.execute(sql, {"email": email, "admin": False})
             conn.commit()
+        # gli altri processi sono avvisati dal trigger (NOTIFY togru_users)
+        invalidate_users_cache()
 
         flash(Markup(f"L'utente <b>{email}</b> è stato aggiunto"), "success")
         return redirect(url_for("aggiungi_user"))
@@ -313,22 +762,15 @@ def attivita_utenti():
     """
     returns list of active users
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        # riepilogo giornaliero mantenuto da trigger (vedi migrations/0009_audit_daily.sql)
         sql = text(
             (
-                #                "SELECT executed_by AS email,"
-                #                "INITCAP(REPLACE(REPLACE(executed_by, '@unito.it', ''), '.', ' ')) AS user, "
-                #                "MAX(executed_at) AS last_operation, "
-                #                "COUNT(*) AS num_operations "
-                #                "FROM inventario_audit "
-                #                "WHERE executed_by like '%@%' "
-                #                "GROUP BY executed_by "
-                #                "ORDER BY last_operation DESC"
                 "SELECT "
-                "    DATE(executed_at) AS day, "
-                "    executed_by AS user, "
-                "    COUNT(*) AS num_operations "
-                "FROM inventario_audit "
+                "    day, "
+                "    NULLIF(executed_by, '') AS user, "
+                "    SUM(num_operations) AS num_operations "
+                "FROM inventario_audit_daily "
                 "GROUP BY day, executed_by "
                 "ORDER BY day DESC, executed_by; "
             )
@@ -345,7 +787,7 @@ def attivita_utente(email: str):
     """
     returns user activity
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         sql = text(
             (
                 "SELECT descrizione_bene, operation_type, record_id, executed_at "
@@ -359,6 +801,26 @@ def attivita_utente(email: str):
     return render_template("attivita_utente.html", attivita=attivita, email=email)
 
 
+@app.route(APP_ROOT + "/pool_metrics", methods=["GET"])
+@check_login
+@check_admin
+def pool_metrics():
+    """
+    connection pool metrics of the worker process (JSON)
+    """
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "pool_size": engine.pool.size(),
+            "max_overflow": app.config["DB_MAX_OVERFLOW"],
+            "checked_in": engine.pool.checkedin(),
+            "checked_out": engine.pool.checkedout(),
+            "overflow": engine.pool.overflow(),
+            **pool_stats,
+        }
+    )
+
+
 @app.route(APP_ROOT + "/callback")
 def callback():
     """
@@ -377,33 +839,17 @@ def callback():
     response = google.get("https://www.googleapis.com/oauth2/v1/userinfo")
     userinfo = response.json()
 
-    with engine.connect() as conn:
-        n_user = conn.execute(
-            text("SELECT COUNT(*) FROM users WHERE email = :email"),
-            {"email": userinfo["email"]},
-        ).scalar()
-        if not n_user:
-            flash(
-                f"Spiacente {userinfo['name']}, non sei autorizzato ad accedere",
-                "danger",
-            )
-            return redirect(url_for("index"))
+    users = authorized_users()
+    if userinfo["email"] not in users:
+        flash(
+            f"Spiacente {userinfo['name']}, non sei autorizzato ad accedere",
+            "danger",
+        )
+        return redirect(url_for("index"))
 
     session["name"] = userinfo["name"]
     session["email"] = userinfo["email"]
-    session["admin"] = False
-
-    # check if admin
-    with engine.connect() as conn:
-        if "email" in session:
-            n = conn.execute(
-                text(
-                    "SELECT COUNT(*) FROM users WHERE admin = TRUE and email = :email"
-                ),
-                {"email": session["email"]},
-            ).scalar()
-            if n:
-                session["admin"] = True
+    session["admin"] = users[userinfo["email"]]
 
     return redirect(url_for("index"))
 
@@ -416,13 +862,111 @@ def collezioni():
     return redirect(f"{APP_ROOT}/search?collezione=true")
 
 
+def run_typst(typst_content: str, output: str, temp_dir: Path) -> bool:
+    """
+    compile a typst source (paths in the source are relative to LABEL_CACHE_DIR)
+
+    Return False if the compilation fails.
+    """
+    temp_typst_path = temp_dir / "label.typst"
+    temp_typst_path.write_text(typst_content)
+
+    completed = subprocess.run(
+        [
+            app.config["TYPST_PATH"],
+            "compile",
+            "--root",
+            app.config["LABEL_CACHE_DIR"],
+            temp_typst_path,
+            temp_dir / output,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode:
+        app.logger.error(f"Errore nella compilazione typst: {completed.stderr}")
+        return False
+    return True
+
+
+def compile_label(records) -> Path | None:
+    """
+    create the PDF of the labels of the records with typst
+
+    Every label is compiled in its own SVG, saved in LABEL_CACHE_DIR with the
+    SHA-256 of its typst source as name: the source contains all the printed
+    fields of the record so a modified record produces a new entry.
+    The labels not in the cache are compiled with a single typst run (one page
+    for label), the PDF of the batch only places the SVG of its labels and is
+    cached in the same way.
+    Return None if the compilation fails.
+    """
+    cache_dir = Path(app.config["LABEL_CACHE_DIR"])
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    labels = {}
+    for record in records:
+        label = label_typst(record)
+        digest = hashlib.sha256(
+            (LABEL_TYPST_HEADER + label).encode("utf-8")
+        ).hexdigest()
+        labels[digest] = label
+
+    missing = []
+    for digest in labels:
+        svg_path = cache_dir / f"{digest}.svg"
+        if svg_path.is_file():
+            # aggiorna la data per l'eliminazione dei file meno usati
+            svg_path.touch()
+        else:
+            missing.append(digest)
+
+    batch_content = LABEL_PAGE_TYPST + "\n".join(
+        f'#block(breakable: false, image("/{digest}.svg", width: 19cm))'
+        for digest in labels
+    )
+    batch_digest = hashlib.sha256(batch_content.encode("utf-8")).hexdigest()
+    pdf_path = cache_dir / f"{batch_digest}.pdf"
+
+    with tempfile.TemporaryDirectory(dir=cache_dir) as temp_dir:
+        temp_dir = Path(temp_dir)
+
+        if missing:
+            labels_content = LABEL_TYPST_HEADER + "\n#pagebreak()\n".join(
+                labels[digest] for digest in missing
+            )
+            if not run_typst(labels_content, "label-{p}.svg", temp_dir):
+                return None
+            # sostituzione atomica: una richiesta concorrente trova il file completo o nessun file
+            for page, digest in enumerate(missing, start=1):
+                (temp_dir / f"label-{page}.svg").replace(cache_dir / f"{digest}.svg")
+
+        if pdf_path.is_file():
+            pdf_path.touch()
+        else:
+            if not run_typst(batch_content, "label.pdf", temp_dir):
+                return None
+            (temp_dir / "label.pdf").replace(pdf_path)
+
+    # elimina i file meno usati oltre LABEL_CACHE_SIZE
+    cached = sorted(
+        [*cache_dir.glob("*.svg"), *cache_dir.glob("*.pdf")],
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    for old_file in cached[app.config["LABEL_CACHE_SIZE"] :]:
+        old_file.unlink(missing_ok=True)
+
+    return pdf_path
+
+
 @app.route(APP_ROOT + "/etichetta", methods=["POST"])
 @app.route(APP_ROOT + "/etichetta/<int:record_id>", methods=["GET"])
 @check_login
 def etichetta(record_id: str = ""):
     """
     Stampa etichetta da incollare sul bene
-    require typst (https://github.com/typst/typst)
+    require typst (https://github.com/typst/typst) or fpdf2 and segno (LABEL_BACKEND = fpdf)
     """
 
     record_ids = request.form.getlist("record_ids")
@@ -432,46 +976,41 @@ def etichetta(record_id: str = ""):
     else:
         record_list = record_ids
 
-    typst_content = label(record_list)
-    if "Error in record list" in typst_content:
-        flash("Un errore è avvenuto", "danger")
-        return redirect(request.referrer)
-
     if len(record_list) > 50:
         flash("Troppi beni selezionati per la stampa (<50)", "danger")
         return redirect(request.referrer)
 
-    if not record_id:
-        record_id = str(uuid.uuid4())
-
-    temp_typst_path: str = ""
-    temp_pdf_path: str = ""
-
     try:
-        temp_typst_path = f"/tmp/label_{record_id}.typst"
-        with open(temp_typst_path, "w") as f_out:
-            _ = f_out.write(typst_content)
-
-        temp_pdf_path = f"/tmp/label_{record_id}.pdf"
+        records = label_records(record_list)
+    except ValueError:
+        records = []
+    if not records:
+        flash("Un errore è avvenuto", "danger")
+        return redirect(request.referrer)
 
-        _ = subprocess.run(
-            [app.config["TYPST_PATH"], "compile", temp_typst_path, temp_pdf_path]
-        )
+    if not record_id:
+        record_id = str(uuid.uuid4())
 
-        # send file to client
+    if app.config["LABEL_BACKEND"] == "fpdf":
         return send_file(
-            temp_pdf_path,
+            BytesIO(label_fpdf(records)),
             mimetype="application/pdf",
             as_attachment=False,
             download_name=f"etichetta_{record_id}.pdf",
         )
 
-    finally:
-        # Delete temp files
-        if Path(temp_typst_path).exists():
-            Path(temp_typst_path).unlink()
-        if Path(temp_pdf_path).exists():
-            Path(temp_pdf_path).unlink()
+    pdf_path = compile_label(records)
+    if pdf_path is None:
+        flash("Errore nella creazione delle etichette", "danger")
+        return redirect(request.referrer)
+
+    # send file to client
+    return send_file(
+        pdf_path,
+        mimetype="application/pdf",
+        as_attachment=False,
+        download_name=f"etichetta_{record_id}.pdf",
+    )
 
 
 @app.route(APP_ROOT + "/delete_foto/<img_id>")
@@ -480,16 +1019,38 @@ def delete_foto(img_id: str):
     """
     cancella foto
     """
-    record_id = img_id.split("_")[0]
+    # nome del file: <record_id>_<n>.<estensione>
+    record_id, _, n = Path(img_id).stem.partition("_")
+    if Path(img_id).name != img_id or not (record_id.isdigit() and n.isdigit()):
+        abort(400)
+    record_id = int(record_id)
+
+    with db_connection() as conn:
+        _ = conn.execute(
+            text(
+                "DELETE FROM foto WHERE record_id = :record_id AND filename = :img_id"
+            ),
+            {"record_id": record_id, "img_id": img_id},
+        )
+        conn.commit()
+
+    for variant in PHOTO_VARIANTS:
+        variant_path(img_id, variant).unlink(missing_ok=True)
+
     if (Path(app.config["UPLOAD_FOLDER"]) / img_id).exists():
         (Path(app.config["UPLOAD_FOLDER"]) / img_id).unlink()
         # record
-        with engine.connect() as conn:
+        with db_connection() as conn:
             _ = conn.execute(
                 text(
-                    f"INSERT INTO inventario_audit (operation_type, record_id, executed_by) VALUES ('DELETED FOTO {img_id}', :record_id, :executed_by)"
+                    "INSERT INTO inventario_audit (operation_type, record_id, executed_by) "
+                    "VALUES (:operation_type, :record_id, :executed_by)"
                 ),
-                {"record_id": record_id, "executed_by": session["email"]},
+                {
+                    "operation_type": f"DELETED FOTO {img_id}",
+                    "record_id": record_id,
+                    "executed_by": session["email"],
+                },
             )
             conn.commit()
 
@@ -504,7 +1065,7 @@ def delete_record(record_id: int, query_string: str = ""):
     """
     delete record
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         _ = conn.execute(
             text("SET LOCAL application_name = :user"), {"user": session["email"]}
         )
@@ -531,7 +1092,7 @@ def delete_user(email: str):
     """
     remove user
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         # check if email in DB
         n_users = conn.execute(
             text("SELECT COUNT(*) FROM users WHERE email = :email"), {"email": email}
@@ -545,11 +1106,17 @@ def delete_user(email: str):
             text("DELETE FROM users WHERE email = :email"), {"email": email}
         )
         conn.commit()
+        # gli altri processi sono avvisati dal trigger (NOTIFY togru_users)
+        invalidate_users_cache()
         flash(Markup(f"L'utente <b>{email}</b> è stato cancellato"), "success")
 
         return redirect(url_for("aggiungi_user"))
 
 
+# numero massimo di copie create con una duplicazione
+MAX_COPIE = 50
+
+
 # Modifica record - form
 @app.route(f"{APP_ROOT}/duplica/<int:record_id>", methods=["GET", "POST"])
 @app.route(APP_ROOT + "/duplica/<int:record_id>/", methods=["GET", "POST"])
@@ -562,7 +1129,7 @@ def duplica(record_id: int, query_string: str = ""):
     duplica un bene
     """
     if request.method == "GET":
-        with engine.connect() as conn:
+        with db_connection() as conn:
             result = conn.execute(
                 text(
                     (
@@ -578,304 +1145,466 @@ def duplica(record_id: int, query_string: str = ""):
             record_id=record_id,
             record=record,
             query_string=query_string,
+            max_copie=MAX_COPIE,
         )
 
     if request.method == "POST":
-        copy_number = int(request.form.get("numero_copie"))
-        with engine.connect() as conn:
-            for i in range(1, copy_number + 1):
-                sql = text(
-                    (
-                        "INSERT INTO inventario ( "
-                        "  num_inventario, "
-                        "  num_inventario_ateneo, "
-                        "  data_carico, "
-                        "  descrizione_bene, "
-                        "  codice_sipi_torino, "
-                        "  codice_sipi_grugliasco, "
-                        "  destinazione, "
-                        "  rosso_fase_alimentazione_privilegiata, "
-                        "  valore_convenzionale, "
-                        "  esercizio_bene_migrato, "
-                        "  responsabile_laboratorio, "
-                        "  gruppo_ricerca, "
-                        "  denominazione_fornitore, "
-                        "  anno_fabbricazione, "
-                        "  numero_seriale, "
-                        "  categoria_inventoriale, "
-                        "  catalogazione_materiale_strumentazione, "
-                        "  peso, "
-                        "  dimensioni, "
-                        "  ditta_costruttrice_fornitrice, "
-                        "  note, "
-                        "  deleted, "
-                        "  microscopia, "
-                        "  catena_del_freddo, "
-                        "  alta_specialistica, "
-                        "  da_movimentare, "
-                        "  trasporto_in_autonomia, "
-                        "  da_disinventariare, "
-                        "  didattica, "
-                        "  collezione "
-                        ") "
-                        "SELECT "
-                        "  num_inventario, "
-                        "  num_inventario_ateneo, "
-                        "  data_carico, "
-                        f"  CONCAT(descrizione_bene, ' #', {i + 1}) , "
-                        "  codice_sipi_torino, "
-                        "  codice_sipi_grugliasco, "
-                        "  destinazione, "
-                        "  rosso_fase_alimentazione_privilegiata, "
-                        "  valore_convenzionale, "
-                        "  esercizio_bene_migrato, "
-                        "  responsabile_laboratorio, "
-                        "  gruppo_ricerca, "
-                        "  denominazione_fornitore, "
-                        "  anno_fabbricazione, "
-                        "  numero_seriale, "
-                        "  categoria_inventoriale, "
-                        "  catalogazione_materiale_strumentazione, "
-                        "  peso, "
-                        "  dimensioni, "
-                        "  ditta_costruttrice_fornitrice, "
-                        "  note, "
-                        "  deleted, "
-                        "  microscopia, "
-                        "  catena_del_freddo, "
-                        "  alta_specialistica, "
-                        "  da_movimentare, "
-                        "  trasporto_in_autonomia, "
-                        "  da_disinventariare, "
-                        "  didattica, "
-                        "  collezione "
-                        "FROM inventario "
-                        "WHERE id = :record_id "
-                    )
-                )
-                _ = conn.execute(sql, {"record_id": record_id})
-                conn.commit()
-
-        flash("Bene duplicato con successo!", "success")
+        try:
+            copy_number = int(request.form.get("numero_copie", ""))
+        except ValueError:
+            copy_number = 0
+        if not 1 <= copy_number <= MAX_COPIE:
+            flash(
+                f"Il numero di copie deve essere compreso tra 1 e {MAX_COPIE}", "danger"
+            )
+            return redirect(
+                url_for("duplica", record_id=record_id, query_string=query_string)
+            )
 
-        return redirect(url_for("search") + "?" + query_string)
+        # tutte le copie con un solo INSERT (copie numerate da #2)
+        with db_connection() as conn:
+            _ = conn.execute(
+                text("SET LOCAL application_name = :user"),
+                {"user": session["email"]},
+            )
+            new_ids = sorted(
+                conn.execute(
+                    text(
+                        (
+                            "INSERT INTO inventario ( "
+                            "  num_inventario, "
+                            "  num_inventario_ateneo, "
+                            "  data_carico, "
+                            "  descrizione_bene, "
+                            "  codice_sipi_torino, "
+                            "  codice_sipi_grugliasco, "
+                            "  destinazione, "
+                            "  rosso_fase_alimentazione_privilegiata, "
+                            "  valore_convenzionale, "
+                            "  esercizio_bene_migrato, "
+                            "  responsabile_laboratorio, "
+                            "  gruppo_ricerca, "
+                            "  denominazione_fornitore, "
+                            "  anno_fabbricazione, "
+                            "  numero_seriale, "
+                            "  categoria_inventoriale, "
+                            "  catalogazione_materiale_strumentazione, "
+                            "  peso, "
+                            "  dimensioni, "
+                            "  ditta_costruttrice_fornitrice, "
+                            "  note, "
+                            "  deleted, "
+                            "  microscopia, "
+                            "  catena_del_freddo, "
+                            "  alta_specialistica, "
+                            "  da_movimentare, "
+                            "  trasporto_in_autonomia, "
+                            "  da_disinventariare, "
+                            "  didattica, "
+                            "  collezione "
+                            ") "
+                            "SELECT "
+                            "  num_inventario, "
+                            "  num_inventario_ateneo, "
+                            "  data_carico, "
+                            "  CONCAT(descrizione_bene, ' #', n), "
+                            "  codice_sipi_torino, "
+                            "  codice_sipi_grugliasco, "
+                            "  destinazione, "
+                            "  rosso_fase_alimentazione_privilegiata, "
+                            "  valore_convenzionale, "
+                            "  esercizio_bene_migrato, "
+                            "  responsabile_laboratorio, "
+                            "  gruppo_ricerca, "
+                            "  denominazione_fornitore, "
+                            "  anno_fabbricazione, "
+                            "  numero_seriale, "
+                            "  categoria_inventoriale, "
+                            "  catalogazione_materiale_strumentazione, "
+                            "  peso, "
+                            "  dimensioni, "
+                            "  ditta_costruttrice_fornitrice, "
+                            "  note, "
+                            "  deleted, "
+                            "  microscopia, "
+                            "  catena_del_freddo, "
+                            "  alta_specialistica, "
+                            "  da_movimentare, "
+                            "  trasporto_in_autonomia, "
+                            "  da_disinventariare, "
+                            "  didattica, "
+                            "  collezione "
+                            "FROM inventario, generate_series(2, :copy_number + 1) AS n "
+                            "WHERE id = :record_id "
+                            "ORDER BY n "
+                            "RETURNING id"
+                        )
+                    ),
+                    {"record_id": record_id, "copy_number": copy_number},
+                ).scalars()
+            )
+            conn.commit()
+
+        # form per stampare le etichette delle copie
+        hidden_ids = "".join(
+            f'<input type="hidden" name="record_ids" value="{x}">' for x in new_ids
+        )
+        flash(
+            Markup(
+                f"Bene duplicato con successo! Create {len(new_ids)} copie "
+                f"(ID {', '.join(str(x) for x in new_ids)}) "
+                f'<form method="post" action="{url_for("etichetta")}" style="display: inline">'
+                f"{hidden_ids}"
+                '<button class="button is-small is-info" type="submit">Stampa etichette delle copie</button>'
+                "</form>"
+            ),
+            "success",
+        )
+
+        return redirect(url_for("search") + "?" + query_string)
+
+
+# statistiche della home page in un'unica scansione di inventario
+DASHBOARD_STATS_SQL = """
+SELECT
+    v.version,
+    jsonb_build_object(
+        'n_records', s.n_beni,
+        'n_beni_senza_responsabile', s.n_beni_senza_responsabile,
+        'n_beni_da_movimentare', s.n_beni_da_movimentare,
+        'n_beni_da_movimentare_in_autonomia', s.n_beni_da_movimentare_in_autonomia,
+        'n_beni_non_conforme', s.n_beni_non_conforme,
+        'alta_specialistica', s.alta_specialistica,
+        'microscopia', s.microscopia,
+        'microscopia_non_alta', s.microscopia_non_alta,
+        'catena_freddo', s.catena_freddo,
+        'peso_totale', s.peso_totale,
+        'volume_totale', s.volume_totale
+    ) AS stats
+FROM (
+    SELECT
+        SUM(quantita) AS n_beni,
+        SUM(quantita) FILTER (
+            WHERE responsabile_id IS NULL
+        ) AS n_beni_senza_responsabile,
+        SUM(quantita) FILTER (
+            WHERE da_movimentare AND NOT trasporto_in_autonomia
+        ) AS n_beni_da_movimentare,
+        SUM(quantita) FILTER (
+            WHERE da_movimentare AND trasporto_in_autonomia
+        ) AS n_beni_da_movimentare_in_autonomia,
+        SUM(quantita) FILTER (WHERE non_conforme) AS n_beni_non_conforme,
+        SUM(quantita) FILTER (
+            WHERE da_movimentare AND alta_specialistica
+        ) AS alta_specialistica,
+        SUM(quantita) FILTER (WHERE da_movimentare AND microscopia) AS microscopia,
+        SUM(quantita) FILTER (
+            WHERE da_movimentare AND microscopia AND NOT alta_specialistica
+        ) AS microscopia_non_alta,
+        SUM(quantita) FILTER (WHERE da_movimentare AND catena_del_freddo) AS catena_freddo,
+        ROUND(SUM(peso_kg * quantita) FILTER (
+            WHERE da_movimentare AND NOT trasporto_in_autonomia
+        )) AS peso_totale,
+        ROUND(SUM(volume_m3 * quantita) FILTER (
+            WHERE da_movimentare AND NOT trasporto_in_autonomia
+        ), 1) AS volume_totale
+    FROM inventario
+    WHERE deleted IS NULL
+) s, inventario_version v
+"""
+
+
+def inventario_version(conn) -> int:
+    """
+    current version of inventario (see migrations/0015_inventario_changes.sql)
+
+    The version is the number of committed transactions that modified inventario:
+    it changes with the commit of the modification.
+    """
+    return conn.execute(text("SELECT version FROM inventario_version")).scalar()
+
+
+def dashboard_stats() -> dict:
+    """
+    statistiche della home page
+
+    Le statistiche sono lette dallo snapshot in inventario_stats e ricalcolate
+    solo se inventario è stato modificato dopo l'ultimo calcolo
+    (vedi migrations/0003_stats.sql).
+    Un solo processo ricalcola le statistiche (advisory lock): gli altri
+    usano nel frattempo quelle precedenti.
+    """
+    with db_connection() as conn:
+        version = inventario_version(conn)
+        snapshot = conn.execute(
+            text("SELECT version, stats FROM inventario_stats")
+        ).fetchone()
+        if snapshot is not None and snapshot.version == version:
+            return snapshot.stats
+
+        if (
+            snapshot is not None
+            and not conn.execute(
+                text("SELECT pg_try_advisory_xact_lock(hashtext('inventario_stats'))")
+            ).scalar()
+        ):
+            return snapshot.stats
+
+        # versione e statistiche lette nello stesso statement (stessi dati)
+        version, stats = conn.execute(text(DASHBOARD_STATS_SQL)).fetchone()
+        _ = conn.execute(
+            text(
+                "INSERT INTO inventario_stats (id, version, stats) "
+                "VALUES (TRUE, :version, CAST(:stats AS jsonb)) "
+                "ON CONFLICT (id) DO UPDATE "
+                "SET version = EXCLUDED.version, stats = EXCLUDED.stats, computed_at = now() "
+                "WHERE inventario_stats.version < EXCLUDED.version"
+            ),
+            {"version": version, "stats": json.dumps(stats)},
+        )
+        conn.commit()
+
+    return stats
 
 
 # Visualizza home page
 @app.route(APP_ROOT)
 @app.route(APP_ROOT + "/")
 def index():
-    with engine.connect() as conn:
-        n_beni = conn.execute(
-            text("SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL")
-        ).scalar()
+    return render_template("index.html", **dashboard_stats())
 
-        n_beni_da_movimentare = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND da_movimentare AND not trasporto_in_autonomia"
-            )
-        ).scalar()
 
-        volume_totale = conn.execute(
-            text("""
-            SELECT
-                ROUND(SUM(
-                    (
-                        (split_part(dimensioni, 'x', 1))::numeric *
-                        (split_part(dimensioni, 'x', 2))::numeric *
-                        (split_part(dimensioni, 'x', 3))::numeric
-                    ) / 1000000.0 * quantita
-                ),1) AS volume_totale_m3
-            FROM inventario
-            WHERE
-                dimensioni ~ '^[0-9]+x[0-9]+x[0-9]+$'
-                AND da_movimentare
-                AND NOT trasporto_in_autonomia
-                AND deleted IS NULL
-        """)
-        ).scalar()
+# URL codificato nel QR code delle etichette
+LABEL_QRCODE_URL = "https://penelope.unito.it/togru/view_qrcode/{}"
 
-        peso_totale = conn.execute(
-            text(
-                "SELECT ROUND(SUM(peso::numeric * quantita)) "
-                "FROM inventario "
-                "WHERE  "
-                "    peso ~ '^[0-9]+(\\.[0-9]+)?$' "
-                "    AND da_movimentare "
-                "    AND NOT trasporto_in_autonomia "
-                "    AND deleted IS NULL"
-            )
-        ).scalar()
 
-        n_beni_non_conforme = conn.execute(
-            text(
-                (
-                    "SELECT SUM(quantita) FROM inventario "
-                    "WHERE deleted IS NULL "
-                    "      AND not collezione "
-                    "      AND da_movimentare "
-                    "      AND not trasporto_in_autonomia "
-                    r"     AND (peso !~ '^-?[0-9]+(\.[0-9]+)?$' OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$')"
-                )
-            )
-        ).scalar()
+def label_records(record_list: list[str]) -> list:
+    """
+    fetch the records to print on the labels
 
-        n_beni_da_movimentare_in_autonomia = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND da_movimentare AND trasporto_in_autonomia"
+    raise ValueError if an id is not an integer
+    """
+    with db_connection() as conn:
+        return (
+            conn.execute(
+                text("SELECT * FROM inventario WHERE id = ANY(:ids) ORDER BY id"),
+                {"ids": [int(x) for x in record_list]},
             )
-        ).scalar()
+            .mappings()
+            .all()
+        )
 
-        alta_specialistica = conn.execute(
-            text(
-                (
-                    "SELECT SUM(quantita) FROM inventario "
-                    "WHERE deleted IS NULL "
-                    "      AND da_movimentare IS True "
-                    "      AND alta_specialistica IS True "
-                )
-            )
-        ).scalar()
 
-        microscopia = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND da_movimentare  AND microscopia"
-            )
-        ).scalar()
+# sorgente typst delle etichette: una pagina della larghezza dell'etichetta per bene
+LABEL_TYPST_HEADER = (
+    '#import "@preview/cades:0.3.0": qr-code\n'
+    "\n"
+    "#set page(width: 19cm, height: auto, margin: 0cm)\n"
+    "\n"
+    "#set text(\n"
+    '  font: "Libertinus Serif",\n'
+    "  size: 11pt,\n"
+    ")\n"
+)
 
-        microscopia_non_alta = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND da_movimentare  AND microscopia AND not alta_specialistica"
-            )
-        ).scalar()
+# pagina A4 con le etichette di una stampa
+LABEL_PAGE_TYPST = "#set page(margin: (top: 1cm, bottom: 1cm, x:1cm))\n\n"
 
-        catena_freddo = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND da_movimentare AND catena_del_freddo"
-            )
-        ).scalar()
 
-        n_beni_senza_responsabile = conn.execute(
-            text(
-                "SELECT SUM(quantita) FROM inventario WHERE deleted IS NULL AND (responsabile_laboratorio = '' OR responsabile_laboratorio IS NULL)"
-            )
-        ).scalar()
+def label_typst(record) -> str:
+    """
+    create the typst label of a record (without LABEL_TYPST_HEADER)
+    """
+    out = ["#block(breakable: false)["]
 
-    return render_template(
-        "index.html",
-        n_records=n_beni,
-        n_beni_senza_responsabile=n_beni_senza_responsabile,
-        n_beni_da_movimentare=n_beni_da_movimentare,
-        n_beni_da_movimentare_in_autonomia=n_beni_da_movimentare_in_autonomia,
-        n_beni_non_conforme=n_beni_non_conforme,
-        alta_specialistica=alta_specialistica,
-        microscopia=microscopia,
-        microscopia_non_alta=microscopia_non_alta,
-        catena_freddo=catena_freddo,
-        peso_totale=peso_totale,
-        volume_totale=volume_totale,
+    out.append(
+        f"""#text(size: 12pt)[*`{record["descrizione_bene"].replace("`", "'") if record["descrizione_bene"] else " "}`*] """
+    )
+
+    out.append("")
+    out.append("#grid(columns: (14cm, 5cm),")
+    out.append("[")
+    if record["responsabile_laboratorio"]:
+        out.append(f"`Responsabile lab:` *`{record['responsabile_laboratorio']}`*")
+    else:
+        out.append("*`SENZA RESPONSABILE`*")
+    out.append("")
+
+    out.append("#grid(columns: (7cm, 7cm),")
+    if record["num_inventario"]:
+        out.append(f"[`Num inv:` *`{record['num_inventario']}`*],")
+    else:
+        out.append("[`Num inventario` *`ASSENTE`*],")
+    out.append(f"[`TOGRU id:` *`{record['id']}`*],")
+    out.append(")")
+    out.append("")
+
+    out.append("#grid(columns: (7cm, 7cm),")
+    out.append("")
+    out.append(
+        f"""[`SIPI TO:` *`{record["codice_sipi_torino"] if record["codice_sipi_torino"] else "-"}`*],"""
+    )
+    out.append(
+        f"""[`SIPI GRU:` *`{record["codice_sipi_grugliasco"] if record["codice_sipi_grugliasco"] else "-"}`*],"""
     )
+    out.append(")")
+    out.append("")
+    out.append(
+        f"""`{"DA MOVIMENTARE" if record["da_movimentare"] else "STRUMENTO/BENE DA NON MOVIMENTARE/DISMETTERE"}`"""
+    )
+    out.append("")
+    out.append(f"""`{"DA DISINVENTARIARE" if record["da_disinventariare"] else ""}`""")
+    out.append("")
+    out.append(
+        f"""`{"TRASPORTO IN AUTONOMIA" if record["trasporto_in_autonomia"] else ""}`"""
+    )
+    out.append("")
+    out.append(f"""`{record["destinazione"]}`""")
+    out.append("")
+    out.append("],")
+    out.append("")
+    out.append("[")
+    out.append("")
+    out.append("#grid( columns: (2.5cm, 2.5cm),")
+    out.append("[")
+    out.append("#rect(width: 2.3cm,height: 2.3cm,")
+    out.append(f"""  fill: {"green" if record["da_movimentare"] else "red"},""")
+    out.append("  stroke: 0.4cm+white,")
+    out.append(")")
+    out.append("],")
+    out.append("[")
+    out.append(f"""#qr-code("{LABEL_QRCODE_URL.format(record["id"])}", width: 2.3cm)""")
+    out.append("]")
+    out.append(")")
+    out.append("]")
+    out.append("")
+    out.append(")")
+    out.append("")
+    out.append("#line(length: 100%)")
+    out.append("")
+    out.append("]")
+
+    return "\n".join(out)
 
 
-def label(record_list: list[str]) -> str:
+def label_fpdf(records) -> bytes:
     """
-    create typst label for records
+    create the PDF of the labels with fpdf2 (same layout of label_typst)
+
+    The QR code is drawn from the matrix created by segno.
     """
-    with engine.connect() as conn:
-        ids = ",".join([str(x) for x in record_list])
-        sql = text(f"SELECT * FROM inventario WHERE id in ({ids})")
-        records = conn.execute(sql).mappings().all()
-        if not records:
-            return f"Error in record list {', '.join(record_list)}"
-
-        label_header = (
-            '#import "@preview/cades:0.3.0": qr-code\n'
-            "\n"
-            "#set page(margin: (top: 1cm, bottom: 1cm, x:1cm))\n"
-            "\n"
-            "#set text(\n"
-            '  font: "Libertinus Serif",\n'
-            "  size: 11pt,\n"
-            ")\n"
-        )
 
-    out = [label_header]
+    def latin1(value) -> str:
+        # i font standard PDF supportano solo latin-1
+        return str(value).encode("latin-1", "replace").decode("latin-1")
 
-    for record in records:
-        out.append("#block(breakable: false)[")
+    def field(x: float, y: float, name: str, value) -> None:
+        # `nome:` *`valore`*
+        pdf.set_xy(x, y)
+        pdf.set_font("Courier", "", 11)
+        pdf.cell(pdf.get_string_width(name) + 2, 5, name)
+        pdf.set_font("Courier", "B", 11)
+        pdf.cell(0, 5, latin1(value))
 
-        out.append(
-            f"""#text(size: 12pt)[*`{record["descrizione_bene"].replace("`", "'") if record["descrizione_bene"] else " "}`*] """
+    pdf = FPDF(orientation="portrait", unit="mm", format="A4")
+    pdf.set_margins(10, 10, 10)
+    pdf.set_auto_page_break(False)
+    pdf.add_page()
+
+    line_height = 6
+    box_size = 23
+
+    for record in records:
+        description = latin1(record["descrizione_bene"] or " ")
+        pdf.set_font("Courier", "B", 12)
+        description_lines = pdf.multi_cell(
+            w=0, h=5.5, text=description, dry_run=True, output="LINES"
         )
+        height = len(description_lines) * 5.5 + 2 + 7 * line_height + 4
+
+        # il blocco di un'etichetta non viene diviso tra due pagine
+        if pdf.get_y() + height > pdf.h - pdf.b_margin:
+            pdf.add_page()
 
-        out.append("")
-        out.append("#grid(columns: (14cm, 5cm),")
-        out.append("[")
+        y = pdf.get_y()
+        pdf.multi_cell(w=0, h=5.5, text=description)
+        y = pdf.get_y() + 2
+
+        # colonna sinistra (14 cm)
         if record["responsabile_laboratorio"]:
-            out.append(f"`Responsabile lab:` *`{record['responsabile_laboratorio']}`*")
+            field(10, y, "Responsabile lab:", record["responsabile_laboratorio"])
         else:
-            out.append("*`SENZA RESPONSABILE`*")
-        out.append("")
+            pdf.set_xy(10, y)
+            pdf.set_font("Courier", "B", 11)
+            pdf.cell(0, 5, "SENZA RESPONSABILE")
 
-        out.append("#grid(columns: (7cm, 7cm),")
         if record["num_inventario"]:
-            out.append(f"[`Num inv:` *`{record['num_inventario']}`*],")
+            field(10, y + line_height, "Num inv:", record["num_inventario"])
         else:
-            out.append("[`Num inventario` *`ASSENTE`*],")
-        out.append(f"[`TOGRU id:` *`{record['id']}`*],")
-        out.append(")")
-        out.append("")
-
-        out.append("#grid(columns: (7cm, 7cm),")
-        out.append("")
-        out.append(
-            f"""[`SIPI TO:` *`{record["codice_sipi_torino"] if record["codice_sipi_torino"] else "-"}`*],"""
-        )
-        out.append(
-            f"""[`SIPI GRU:` *`{record["codice_sipi_grugliasco"] if record["codice_sipi_grugliasco"] else "-"}`*],"""
-        )
-        out.append(")")
-        out.append("")
-        out.append(
-            f"""`{"DA MOVIMENTARE" if record["da_movimentare"] else "STRUMENTO/BENE DA NON MOVIMENTARE/DISMETTERE"}`"""
-        )
-        out.append("")
-        out.append(
-            f"""`{"DA DISINVENTARIARE" if record["da_disinventariare"] else ""}`"""
+            field(10, y + line_height, "Num inventario", "ASSENTE")
+        field(80, y + line_height, "TOGRU id:", record["id"])
+
+        field(10, y + 2 * line_height, "SIPI TO:", record["codice_sipi_torino"] or "-")
+        field(
+            80,
+            y + 2 * line_height,
+            "SIPI GRU:",
+            record["codice_sipi_grugliasco"] or "-",
         )
-        out.append("")
-        out.append(
-            f"""`{"TRASPORTO IN AUTONOMIA" if record["trasporto_in_autonomia"] else ""}`"""
-        )
-        out.append("")
-        out.append(f"""`{record["destinazione"]}`""")
-        out.append("")
-        out.append("],")
-        out.append("")
-        out.append("[")
-        out.append("")
-        out.append("#grid( columns: (2.5cm, 2.5cm),")
-        out.append("[")
-        out.append("#rect(width: 2.3cm,height: 2.3cm,")
-        out.append(f"""  fill: {"green" if record["da_movimentare"] else "red"},""")
-        out.append("  stroke: 0.4cm+white,")
-        out.append(")")
-        out.append("],")
-        out.append("[")
-        out.append(
-            f"""#qr-code("https://penelope.unito.it/togru/view_qrcode/{record["id"]}", width: 2.3cm)"""
+
+        pdf.set_font("Courier", "", 11)
+        for idx, value in enumerate(
+            (
+                "DA MOVIMENTARE"
+                if record["da_movimentare"]
+                else "STRUMENTO/BENE DA NON MOVIMENTARE/DISMETTERE",
+                "DA DISINVENTARIARE" if record["da_disinventariare"] else "",
+                "TRASPORTO IN AUTONOMIA" if record["trasporto_in_autonomia"] else "",
+                record["destinazione"] or "",
+            ),
+            start=3,
+        ):
+            pdf.set_xy(10, y + idx * line_height)
+            pdf.cell(0, 5, latin1(value))
+
+        # colonna destra (5 cm): riquadro verde/rosso e QR code
+        if record["da_movimentare"]:
+            pdf.set_fill_color(0, 128, 0)
+        else:
+            pdf.set_fill_color(255, 0, 0)
+        pdf.rect(152, y + 2, box_size - 4, box_size - 4, style="F")
+
+        # maschera fissa: la scelta automatica della maschera migliore
+        # è la parte più lenta della codifica
+        qr = segno.make(
+            LABEL_QRCODE_URL.format(record["id"]), error="m", mask=0, micro=False
         )
-        out.append("]")
-        out.append(")")
-        out.append("]")
-        out.append("")
-        out.append(")")
-        out.append("")
-        out.append("#line(length: 100%)")
-        out.append("")
-        out.append("]")
+        matrix = list(qr.matrix_iter(border=0))
+        module = box_size / len(matrix)
+        pdf.set_fill_color(0, 0, 0)
+        for row_idx, row in enumerate(matrix):
+            # moduli scuri consecutivi disegnati con un solo rettangolo
+            col_idx = 0
+            while col_idx < len(row):
+                if not row[col_idx]:
+                    col_idx += 1
+                    continue
+                start = col_idx
+                while col_idx < len(row) and row[col_idx]:
+                    col_idx += 1
+                pdf.rect(
+                    175 + start * module,
+                    y + row_idx * module,
+                    (col_idx - start) * module,
+                    module,
+                    style=RenderStyle.F,
+                )
 
-    return "\n".join(out)
+        y += max(7 * line_height, box_size) + 2
+        pdf.line(10, y, pdf.w - 10, y)
+        pdf.set_y(y + 2)
+
+    return bytes(pdf.output())
 
 
 @app.route(APP_ROOT + "/login")
@@ -918,11 +1647,11 @@ def modifica(record_id: int, query_string: str = ""):
     """
     modifica un bene
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         result = conn.execute(
             text(
                 (
-                    "SELECT id, quantita, descrizione_bene, responsabile_laboratorio, "
+                    "SELECT id, quantita, descrizione_bene, responsabile_laboratorio, responsabile_id, "
                     "num_inventario, num_inventario_ateneo, data_carico,"
                     "codice_sipi_torino, codice_sipi_grugliasco, destinazione,"
                     "CASE WHEN microscopia THEN 'SI' ELSE 'NO' END AS microscopia,"
@@ -939,8 +1668,7 @@ def modifica(record_id: int, query_string: str = ""):
                     "denominazione_fornitore, anno_fabbricazione, numero_seriale,"
                     "categoria_inventoriale, catalogazione_materiale_strumentazione, peso, dimensioni,"
                     "ditta_costruttrice_fornitrice, note, "
-                    r"(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$') AS peso_non_conforme, "  #
-                    "(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$') AS dimensioni_non_conforme "
+                    "peso_non_conforme, dimensioni_non_conforme "
                     "FROM inventario "
                     "WHERE id = :id"
                 )
@@ -949,17 +1677,10 @@ def modifica(record_id: int, query_string: str = ""):
         )
         record = result.mappings().fetchone()
 
-        responsabili = conn.execute(
-            text(
-                "SELECT DISTINCT responsabile_laboratorio FROM inventario WHERE deleted IS NULL ORDER BY responsabile_laboratorio"
-            )
-        ).fetchall()
+        responsabili = active_responsabili(conn)
 
         # check for images
-        img_list = [
-            x.name
-            for x in list(Path(app.config["UPLOAD_FOLDER"]).glob(f"{record_id}_*.*"))
-        ]
+        img_list = record_photos(conn, record_id)
 
     return render_template(
         "modifica.html",
@@ -979,8 +1700,12 @@ def modifica(record_id: int, query_string: str = ""):
 def modifica_multipla():
     campo = request.form.get("campo")
     nuovo_valore = request.form.get("nuovo_valore")
-    record_ids = request.form.getlist("record_ids")
     query_string = request.form.get("query_string", "")
+    try:
+        record_ids = [int(x) for x in request.form.getlist("record_ids")]
+    except ValueError:
+        flash("Selezione dei beni non valida", "danger")
+        return redirect(url_for("search") + "?" + query_string)
 
     if campo in (
         "da_movimentare",
@@ -1029,18 +1754,27 @@ def modifica_multipla():
                 flash(str(exc), "danger")
                 return redirect(url_for("search") + "?" + query_string)
 
-        with engine.connect() as conn:
-            for rid in record_ids:
-                query = text(
-                    f"UPDATE inventario SET {campo} = :nuovo_valore WHERE id = :id"
-                )
+        # un solo UPDATE per tutti i beni selezionati (una transazione)
+        with db_connection() as conn:
+            _ = conn.execute(
+                text("SET LOCAL application_name = :user"),
+                {"user": session["email"]},
+            )
+            n_records = conn.execute(
+                text(
+                    f"UPDATE inventario SET {campo} = :nuovo_valore WHERE id = ANY(:ids)"
+                ),
+                {"ids": record_ids, "nuovo_valore": nuovo_valore},
+            ).rowcount
+            conn.commit()
 
-                conn.execute(
-                    text("SET LOCAL application_name = :user"),
-                    {"user": session["email"]},
-                )
-                conn.execute(query, {"id": rid, "nuovo_valore": nuovo_valore})
-                conn.commit()
+        flash(
+            Markup(
+                f"<b>{campo.replace('_', ' ')}</b> modificato per {n_records} "
+                f"{'bene' if n_records == 1 else 'beni'}"
+            ),
+            "success",
+        )
 
     return redirect(url_for("search") + "?" + query_string)
 
@@ -1207,12 +1941,10 @@ def salva_modifiche(record_id):
         value = request.form.get(field)
         data[field] = value == "true"
 
-    # check for new responsabile
-    if data["responsabile_laboratorio"] == "altro":
-        data["responsabile_laboratorio"] = data["nuovo_responsabile_laboratorio"]
-
     try:
         data["gruppo_ricerca"] = normalize_gruppo_ricerca(data.get("gruppo_ricerca"))
+        with db_connection() as conn:
+            data["responsabile_laboratorio"] = form_responsabile(conn, request.form)
     except ValueError as exc:
         flash(str(exc), "danger")
         return redirect(request.referrer or url_for("modifica", record_id=record_id))
@@ -1253,7 +1985,7 @@ def salva_modifiche(record_id):
             "WHERE id = :id "
         )
     )
-    with engine.connect() as conn:
+    with db_connection() as conn:
         _ = conn.execute(
             text("SET LOCAL application_name = :user"), {"user": session["email"]}
         )
@@ -1262,24 +1994,8 @@ def salva_modifiche(record_id):
 
     foto = request.files.get("foto")
     if foto and foto.filename != "":
-        # filename = secure_filename(foto.filename)
-        img_list = [
-            x.stem
-            for x in list(Path(app.config["UPLOAD_FOLDER"]).glob(f"{record_id}_*.*"))
-        ]
-        if not img_list:
-            foto.save(
-                Path(app.config["UPLOAD_FOLDER"])
-                / Path(str(record_id) + "_1").with_suffix(Path(foto.filename).suffix)
-            )
-        else:
-            img_id = max([int(x.split("_")[1]) for x in img_list]) + 1
-            foto.save(
-                Path(app.config["UPLOAD_FOLDER"])
-                / Path(str(record_id) + f"_{img_id}").with_suffix(
-                    Path(foto.filename).suffix
-                )
-            )
+        with db_connection() as conn:
+            _ = save_photo(conn, record_id, foto)
 
     query_string = request.form.get("query_string", "")
     if query_string == "tutti":
@@ -1290,370 +2006,493 @@ def salva_modifiche(record_id):
         return redirect(url_for("index"))
 
 
-@app.route(APP_ROOT + "/search", methods=["GET"])
-@check_login
-def search():
-    # Lista di tutti i campi su cui cercare
-    fields = [
-        # "descrizione_inventario",
-        "descrizione_bene",
-        "responsabile_laboratorio",
-        "gruppo_ricerca",
-        "collezione",
-        "num_inventario",
-        "num_inventario_ateneo",
-        "data_carico",
-        "codice_sipi_torino",
-        "codice_sipi_grugliasco",
-        "destinazione",
-        "microscopia",
-        "catena_del_freddo",
-        "alta_specialistica",
-        "da_movimentare",
-        "trasporto_in_autonomia",
-        "da_disinventariare",
-        "rosso_fase_alimentazione_privilegiata",
-        "didattica",
-        # "valore_convenzionale",
-        # "esercizio_bene_migrato",
-        "denominazione_fornitore",
-        "anno_fabbricazione",
-        "numero_seriale",
-        "categoria_inventoriale",
-        "catalogazione_materiale_strumentazione",
-        # "peso",
-        # "dimensioni",
-        "ditta_costruttrice_fornitrice",
-        "note",
+# colonne non esportate nei fogli di calcolo
+NOT_EXPORTED_COLUMNS = ("peso_non_conforme", "dimensioni_non_conforme")
+
+
+def send_xlsx(conn, sql, params: dict, download_name: str):
+    """
+    export the result of the query in a XLSX file
+
+    Rows are fetched with a server-side cursor and written by xlsxwriter in
+    constant_memory mode into a temporary file, so the memory used does not
+    depend on the number of rows. Boolean values are written as SI/NO.
+    """
+    result = conn.execute(
+        sql.execution_options(stream_results=True, yield_per=1000), params
+    )
+    columns = [
+        (idx, name)
+        for idx, name in enumerate(result.keys())
+        if name not in NOT_EXPORTED_COLUMNS
     ]
 
-    query_string = request.query_string.decode("utf-8")
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Risultati")
+    header_format = workbook.add_format({"bold": True, "border": 1})
+
+    for col, (_, name) in enumerate(columns):
+        worksheet.write_string(0, col, name, header_format)
+
+    for row_num, row in enumerate(result, start=1):
+        for col, value in enumerate(row[idx] for idx, _ in columns):
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                worksheet.write_string(row_num, col, "SI" if value else "NO")
+            elif isinstance(value, (int, float, Decimal)):
+                worksheet.write_number(row_num, col, value)
+            else:
+                worksheet.write_string(row_num, col, str(value))
 
-    # Controlla se almeno un parametro di ricerca è presente e non vuoto
-    has_filter = any(request.args.get(field, "").strip() for field in fields)
+    workbook.close()
+    output.seek(0)
 
-    n_beni_non_conformi: int = 0
+    return send_file(
+        output,
+        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        as_attachment=True,
+        download_name=download_name,
+    )
 
-    if not has_filter:
-        # Nessun filtro: non eseguire query, ritorna lista vuota o messaggio
-        records = []
-        keys = fields
-    else:
-        query: str = (
-            'SELECT id AS "ID", '
-            'quantita as "Quantità", '
-            'descrizione_bene AS "Descrizione bene", '
-            'responsabile_laboratorio AS "Responsabile Laboratorio / Ufficio", '
-            "COALESCE(gruppo_ricerca, '') AS \"Gruppo ricerca\", "
-            "da_movimentare, catena_del_freddo, trasporto_in_autonomia, microscopia, alta_specialistica, collezione, "
-            'codice_sipi_torino AS "Codice SIPI Torino", '
-            'codice_sipi_grugliasco AS "Codice SIPI Grugliasco", '
-            'destinazione AS "Destinazione", '
-            'note AS "Note", '
-            r"(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$')  AS peso_non_conforme, "
-            "(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$') AS dimensioni_non_conforme "
-            "FROM inventario "
-            "WHERE deleted IS NULL "
+
+# colonne dell'elenco dei beni (table.html)
+TABLE_COLUMNS = (
+    'id AS "ID", '
+    'quantita as "Quantità", '
+    'descrizione_bene AS "Descrizione bene", '
+    'responsabile_laboratorio AS "Responsabile Laboratorio / Ufficio", '
+    "COALESCE(gruppo_ricerca, '') AS \"Gruppo ricerca\", "
+    "da_movimentare, catena_del_freddo, trasporto_in_autonomia, microscopia, alta_specialistica, collezione, "
+    'codice_sipi_torino AS "Codice SIPI Torino", '
+    'codice_sipi_grugliasco AS "Codice SIPI Grugliasco", '
+    'destinazione AS "Destinazione", '
+    'note AS "Note", '
+    "peso_non_conforme, dimensioni_non_conforme "
+)
+
+# chiave della paginazione keyset (vedi migrations/0005_keyset_index.sql)
+KEYSET_KEY = "COALESCE(descrizione_bene, ''), id"
+
+
+def fetch_page(
+    conn,
+    where: str,
+    params: dict,
+    after: int | None = None,
+    before: int | None = None,
+    columns: str = TABLE_COLUMNS,
+):
+    """
+    returns a page of inventario records ordered by (descrizione_bene, id)
+
+    after / before are the id of the last / first record of the adjacent page:
+    if that record no longer exists the first page is returned
+    columns must start with the id
+    returns records, keys, has_previous, has_next
+    """
+    page_size: int = app.config["PAGE_SIZE"]
+
+    keyset = None
+    if before or after:
+        keyset = conn.execute(
+            text(f"SELECT {KEYSET_KEY} FROM inventario WHERE id = :id"),
+            {"id": before or after},
+        ).fetchone()
+        if keyset is None:
+            before = after = None
+
+    sql = f"SELECT {columns} FROM inventario WHERE {where} "
+    if before:
+        sql += (
+            f"AND ({KEYSET_KEY}) < (:keyset_descrizione, :keyset_id) "
+            "ORDER BY COALESCE(descrizione_bene, '') DESC, id DESC "
         )
-        params: dict[str, str] = {}
-
-        query_non_conforme: str = (
-            "SELECT count(*) FROM inventario "
-            " WHERE "
-            "    deleted IS NULL "
-            r"   AND ((collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$') "
-            r"     OR (collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$')) "
+    elif after:
+        sql += (
+            f"AND ({KEYSET_KEY}) > (:keyset_descrizione, :keyset_id) "
+            f"ORDER BY {KEYSET_KEY} "
         )
+    else:
+        sql += f"ORDER BY {KEYSET_KEY} "
+    sql += "LIMIT :page_limit"
+
+    result = conn.execute(
+        text(sql),
+        {
+            **params,
+            "keyset_descrizione": keyset[0] if keyset else None,
+            "keyset_id": keyset[1] if keyset else None,
+            "page_limit": page_size + 1,
+        },
+    )
+    records = result.fetchall()
+    keys = result.keys()
+
+    more = len(records) > page_size
+    records = records[:page_size]
+    if before:
+        records.reverse()
+        return records, keys, more, True
+
+    return records, keys, bool(after), more
+
+
+def page_urls(endpoint: str, records, has_previous: bool, has_next: bool, **values):
+    """
+    URL of the first, previous and next page for pagination.html
+    """
+    return {
+        "first": url_for(endpoint, **values) if has_previous else None,
+        "previous": url_for(endpoint, **values, before=records[0][0])
+        if has_previous and records
+        else None,
+        "next": url_for(endpoint, **values, after=records[-1][0])
+        if has_next and records
+        else None,
+    }
+
+
+def search_filter(args) -> tuple[str, dict[str, str | list[str] | list[int]]]:
+    """
+    compile the search() filters in a WHERE clause for inventario
+
+    raise ValueError if the gruppo ricerca or the responsabile_id are not valid
+    """
+    where: str = "deleted IS NULL"
+    params: dict[str, str | list[str] | list[int]] = {}
 
-        for field in fields:
-            if field in BOOLEAN_FIELDS:
-                if not request.args.get(field, ""):
+    # responsabili scelti per id, separati da virgola (vedi search_responsabile.html)
+    if args.get("responsabile_id", "").strip():
+        try:
+            params["responsabile_id"] = [
+                int(x) for x in args.get("responsabile_id").split(",") if x.strip()
+            ]
+        except ValueError:
+            raise ValueError("Responsabile non valido") from None
+        where += " AND responsabile_id = ANY(:responsabile_id)"
+
+    # ricerca libera full-text (vedi migrations/0006_search_indexes.sql)
+    if args.get("q", "").strip():
+        where += " AND search_tsv @@ websearch_to_tsquery('italian', :q)"
+        params["q"] = args.get("q", "").strip()
+
+    for field in SEARCH_FIELDS:
+        if field in BOOLEAN_FIELDS:
+            if not args.get(field, ""):
+                continue
+            value = args.get(field, "") == "true"
+            where += f" AND {field} IS {value}"
+        else:
+            value = args.get(field, "").strip()
+            if value:
+                # responsabili separati da virgola, cercati nella tabella responsabili
+                if field == "responsabile_laboratorio":
+                    if value == "SENZA":
+                        where += " AND responsabile_id IS NULL"
+                    else:
+                        where += (
+                            " AND responsabile_id IN ("
+                            "SELECT id FROM responsabili "
+                            "WHERE nome ILIKE ANY(:responsabile_laboratorio))"
+                        )
+                        params[field] = [
+                            f"%{resp.strip()}%"
+                            for resp in value.split(",")
+                            if resp.strip()
+                        ]
                     continue
-                value = request.args.get(field, "") == "true"
-                query += f" AND {field} IS {value}"
-                query_non_conforme += f" AND {field} IS {value}"
-            else:
-                value = request.args.get(field, "").strip()
-                if value:
-                    # add senza responsabile
-                    if field == "responsabile_laboratorio":
-                        if value == "SENZA":
-                            query += f" AND ({field} = '' OR {field} IS NULL)"
-                            query_non_conforme += (
-                                f" AND ({field} = '' OR {field} IS NULL)"
-                            )
-                            continue
-                        if "," in value:
-                            subquery = ""
-                            for resp in [x.strip() for x in value.split(",")]:
-                                if subquery:
-                                    subquery += " OR "
-                                subquery += f"{field} ILIKE '%{resp}%' "
-                            query += f" AND ({subquery})"
-                            query_non_conforme += f" AND ({subquery})"
-                            continue
-
-                    if field == "gruppo_ricerca":
-                        if value == "SENZA":
-                            query += f" AND ({field} = '' OR {field} IS NULL)"
-                            query_non_conforme += (
-                                f" AND ({field} = '' OR {field} IS NULL)"
-                            )
-                        else:
-                            try:
-                                value = normalize_gruppo_ricerca(value)
-                            except ValueError as exc:
-                                flash(str(exc), "danger")
-                                return redirect(url_for("search"))
-                            query += f" AND {field} = :{field}"
-                            query_non_conforme += f" AND {field} = :{field}"
-                            params[field] = value
-                        continue
 
+                if field == "gruppo_ricerca":
                     if value == "SENZA":
-                        # add senza Codice SIPI Torino
-                        if field == "codice_sipi_torino":
-                            query += f" AND ({field} = '' OR {field} IS NULL)"
-                            query_non_conforme += (
-                                f" AND ({field} = '' OR {field} IS NULL)"
-                            )
-                            continue
-                        # add senza Codice SIPI Grugliasco
-                        if field == "codice_sipi_grugliasco":
-                            query += f" AND ({field} = '' OR {field} IS NULL)"
-                            query_non_conforme += (
-                                f" AND ({field} = '' OR {field} IS NULL)"
-                            )
-                            continue
-
-                    # Per testo, ricerca con ILIKE e wildcard %
-                    query += f" AND {field} ILIKE :{field}"
-                    query_non_conforme += f" AND {field} ILIKE :{field}"
-                    params[field] = f"%{value}%"
-
-        query += " ORDER BY descrizione_bene ASC"
-
-        # numero beni da fare movimentare con peso e/o dimensioni non conformi
-        sql_non_conforme = text(query_non_conforme)
-        with engine.connect() as conn:
-            n_beni_non_conformi: int = conn.execute(sql_non_conforme, params).scalar()
+                        where += f" AND ({field} = '' OR {field} IS NULL)"
+                    else:
+                        where += f" AND {field} = :{field}"
+                        params[field] = normalize_gruppo_ricerca(value)
+                    continue
 
-        print(f"{query=}")
+                if value == "SENZA":
+                    # add senza Codice SIPI Torino / Codice SIPI Grugliasco
+                    if field in ("codice_sipi_torino", "codice_sipi_grugliasco"):
+                        where += f" AND ({field} = '' OR {field} IS NULL)"
+                        continue
 
-        sql = text(query)
-        with engine.connect() as conn:
-            result = conn.execute(sql, params)
-            records = result.fetchall()
-            keys = result.keys()
+                # Per testo, ricerca con ILIKE e wildcard %
+                where += f" AND {field} ILIKE :{field}"
+                params[field] = f"%{value}%"
 
-    ids = [x[0] for x in records]
+    return where, params
 
-    n_beni = sum([x[1] for x in records])
 
-    # check for doc photo
-    doc_photo = {
-        int(x.stem.split("_")[0]): x.name
-        for x in list(Path(app.config["UPLOAD_FOLDER"]).glob("*_*.*"))
-        if int(x.stem.split("_")[0]) in ids
-    }
+@app.route(APP_ROOT + "/search", methods=["GET"])
+@check_login
+def search():
+    query_string = request.query_string.decode("utf-8")
 
-    # volume totale m³
-    with engine.connect() as conn:
-        volume_totale = conn.execute(
-            text("""
-            SELECT
-                ROUND(SUM(
-                    (
-                        (split_part(dimensioni, 'x', 1))::numeric *
-                        (split_part(dimensioni, 'x', 2))::numeric *
-                        (split_part(dimensioni, 'x', 3))::numeric
-                    ) / 1000000.0 * quantita
-                ),1) AS volume_totale_m3
-            FROM inventario
-            WHERE id IN :ids
-                AND dimensioni ~ '^[0-9]+x[0-9]+x[0-9]+$'
-                AND da_movimentare
-                AND NOT trasporto_in_autonomia
-                AND deleted IS NULL
-        """).bindparams(bindparam("ids", expanding=True)),
-            {"ids": ids},
-        ).scalar()
+    # Controlla se almeno un parametro di ricerca è presente e non vuoto
+    has_filter = any(
+        request.args.get(field, "").strip()
+        for field in ["q", "responsabile_id", *SEARCH_FIELDS]
+    )
 
-    #  peso totale
-    with engine.connect() as conn:
-        peso_totale = conn.execute(
-            text(
-                "SELECT ROUND(SUM(peso::numeric * quantita)) "
-                "FROM inventario "
-                "WHERE id IN :ids "
-                "    AND peso ~ '^[0-9]+(\\.[0-9]+)?$' "
-                "    AND da_movimentare "
-                "    AND NOT trasporto_in_autonomia "
-                "    AND deleted IS NULL"
-            ).bindparams(bindparam("ids", expanding=True)),
-            {"ids": ids},
-        ).scalar()
+    if not has_filter:
+        # Nessun filtro: non eseguire query, ritorna lista vuota o messaggio
+        return render_template(
+            "search.html",
+            records=[],
+            request_args=request.args,
+            fields=SEARCH_FIELDS,
+            query_string=query_string,
+            boolean_fields=BOOLEAN_FIELDS,
+            choice_fields=CHOICE_FIELDS,
+            columns=SEARCH_FIELDS,
+        )
 
-    # Se viene richiesta esportazione spreadsheet e ci sono risultati
-    if request.args.get("export", "").lower() in ("xlsx", "ods") and records:
-        ids = [x[0] for x in records]
-        with engine.connect() as conn:
-            results = conn.execute(
-                text(
-                    (
-                        "SELECT id, "
-                        'quantita as "Quantità", '
-                        'descrizione_bene AS "Descrizione bene",'
-                        'responsabile_laboratorio AS "Responsabile Laboratorio / Ufficio",'
-                        "COALESCE(gruppo_ricerca, '') AS \"Gruppo ricerca\","
-                        "da_movimentare, catena_del_freddo, trasporto_in_autonomia, microscopia, alta_specialistica, collezione, "
-                        'peso AS "Peso singolo (Kg)", '
-                        "CASE "
-                        "WHEN peso ~  '^[0-9]+(\\.[0-9]+)?$' "
-                        "   THEN "
-                        "     ROUND(peso::numeric * quantita * 1, 3)::text "
-                        "   ELSE NULL "
-                        'END AS "Peso x quantità (Kg)", '
-                        'dimensioni AS "Dimensioni singolo (cm)",'
-                        "CASE "
-                        "WHEN dimensioni ~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                        "THEN "
-                        "    ROUND((split_part(dimensioni, 'x', 1)::numeric * "
-                        "     split_part(dimensioni, 'x', 2)::numeric * "
-                        "     split_part(dimensioni, 'x', 3)::numeric) / 1000000.0 * quantita, 4) "
-                        "ELSE NULL "
-                        'END AS "Volume x quantità (m³)", '
-                        'codice_sipi_torino AS "Codice SIPI Torino", '
-                        'codice_sipi_grugliasco AS "Codice SIPI Grugliasco", '
-                        'destinazione AS "Destinazione", '
-                        'note AS "Note", '
-                        r"(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$')  AS peso_non_conforme, "
-                        "(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$') AS dimensioni_non_conforme "
-                        "FROM inventario WHERE id IN :ids AND deleted IS NULL "
-                    )
-                ).bindparams(bindparam("ids", expanding=True)),
-                {"ids": ids},
-            )
-            records = results.fetchall()
-            keys = results.keys()
+    try:
+        where, params = search_filter(request.args)
+    except ValueError as exc:
+        flash(str(exc), "danger")
+        return redirect(url_for("search"))
+
+    # Se viene richiesta esportazione spreadsheet
+    export = request.args.get("export", "").lower()
+    if export in ("xlsx", "ods"):
+        # una sola query con il filtro della ricerca:
+        # i totali su tutti i beni trovati sono calcolati come window aggregate
+        export_sql = text(
+            "SELECT id, "
+            'quantita as "Quantità", '
+            'descrizione_bene AS "Descrizione bene",'
+            'responsabile_laboratorio AS "Responsabile Laboratorio / Ufficio",'
+            "COALESCE(gruppo_ricerca, '') AS \"Gruppo ricerca\","
+            "da_movimentare, catena_del_freddo, trasporto_in_autonomia, microscopia, alta_specialistica, collezione, "
+            'peso AS "Peso singolo (Kg)", '
+            'ROUND(peso_kg * quantita, 3)::text AS "Peso x quantità (Kg)", '
+            'dimensioni AS "Dimensioni singolo (cm)",'
+            'ROUND(volume_m3 * quantita, 4) AS "Volume x quantità (m³)", '
+            'codice_sipi_torino AS "Codice SIPI Torino", '
+            'codice_sipi_grugliasco AS "Codice SIPI Grugliasco", '
+            'destinazione AS "Destinazione", '
+            'note AS "Note", '
+            "peso_non_conforme, dimensioni_non_conforme, "
+            'ROUND(COALESCE(SUM(volume_m3 * quantita) OVER (), 0), 2) AS "volume totale tutti beni (m³)", '
+            'ROUND(COALESCE(SUM(peso_kg * quantita) OVER (), 0), 2) AS "Peso totale tutti beni (Kg)" '
+            f"FROM inventario WHERE {where} "
+            "ORDER BY descrizione_bene ASC"
+        )
 
-        # volume totale m³
-        with engine.connect() as conn:
-            volume_totale = conn.execute(
-                text("""
-                SELECT
-                    SUM(
-                        (
-                            (split_part(dimensioni, 'x', 1))::numeric *
-                            (split_part(dimensioni, 'x', 2))::numeric *
-                            (split_part(dimensioni, 'x', 3))::numeric
-                        ) / 1000000.0 * quantita
-                    ) AS volume_totale_m3
-                FROM inventario WHERE id IN :ids AND dimensioni ~ '^[0-9]+x[0-9]+x[0-9]+$' AND deleted IS NULL
-            """).bindparams(bindparam("ids", expanding=True)),
-                {"ids": ids},
-            ).scalar()
+        with db_connection() as conn:
+            if export == "xlsx":
+                return send_xlsx(conn, export_sql, params, "risultati_ricerca.xlsx")
 
-        #  peso totale
-        with engine.connect() as conn:
-            peso_totale = conn.execute(
-                text(
-                    "SELECT SUM(peso::numeric * quantita) "
-                    "FROM inventario WHERE id IN :ids AND peso ~ '^[0-9]+(\\.[0-9]+)?$' AND deleted IS NULL"
-                ).bindparams(bindparam("ids", expanding=True)),
-                {"ids": ids},
-            ).scalar()
+            results = conn.execute(export_sql, params)
+            records = results.fetchall()
+            keys = results.keys()
 
         df = pd.DataFrame(records, columns=keys)
-        df = df.drop(columns=["peso_non_conforme", "dimensioni_non_conforme"])
+        df = df.drop(columns=list(NOT_EXPORTED_COLUMNS))
         df = df.replace({True: "SI", False: "NO"})
-        # add volume totale
-        df["volume totale tutti beni (m³)"] = round(volume_totale, 2)
-        # add peso totale
-        df["Peso totale tutti beni (Kg)"] = round(peso_totale, 2)
 
         output = BytesIO()
-        spreadsheet_engine: Literal["xlsxwriter", "odf"] = (
-            "xlsxwriter" if request.args.get("export", "").lower() == "xlsx" else "odf"
-        )
-        with pd.ExcelWriter(output, engine=spreadsheet_engine) as writer:
+        with pd.ExcelWriter(output, engine="odf") as writer:
             df.to_excel(writer, index=False, sheet_name="Risultati")
         output.seek(0)
 
         return send_file(
             output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            if spreadsheet_engine == "xlsxwriter"
-            else "application/vnd.oasis.opendocument.spreadsheet",
+            mimetype="application/vnd.oasis.opendocument.spreadsheet",
             as_attachment=True,
-            download_name=f"risultati_ricerca.{'xlsx' if spreadsheet_engine == 'xlsxwriter' else 'ods'}",
+            download_name="risultati_ricerca.ods",
         )
 
-    return render_template(
-        "search.html",
-        n_beni=n_beni,
-        records=records,
+    with db_connection() as conn:
+        # totali calcolati su tutti i risultati (non solo sulla pagina)
+        totali = conn.execute(
+            text(
+                "SELECT "
+                "    COUNT(*) AS n_records, "
+                "    SUM(quantita) AS n_beni, "
+                "    COUNT(*) FILTER (WHERE non_conforme) AS n_beni_non_conformi, "
+                "    ROUND(SUM(volume_m3 * quantita) FILTER ("
+                "        WHERE da_movimentare AND NOT trasporto_in_autonomia"
+                "    ), 1) AS volume_totale, "
+                "    ROUND(SUM(peso_kg * quantita) FILTER ("
+                "        WHERE da_movimentare AND NOT trasporto_in_autonomia"
+                "    )) AS peso_totale "
+                f"FROM inventario WHERE {where}"
+            ),
+            params,
+        ).fetchone()
+
+        records, keys, has_previous, has_next = fetch_page(
+            conn,
+            where,
+            params,
+            after=request.args.get("after", type=int),
+            before=request.args.get("before", type=int),
+        )
+
+        # check for doc photo
+        doc_photo = first_photos(conn, [x[0] for x in records])
+
+    return render_template(
+        "search.html",
+        n_records=totali.n_records,
+        n_beni=totali.n_beni,
+        records=records,
         request_args=request.args,
-        fields=fields,
+        fields=SEARCH_FIELDS,
         query_string=query_string,
         boolean_fields=BOOLEAN_FIELDS,
         choice_fields=CHOICE_FIELDS,
         columns=keys,
-        n_beni_non_conformi=n_beni_non_conformi,
+        n_beni_non_conformi=totali.n_beni_non_conformi,
         doc_photo=doc_photo,
-        volume_totale=volume_totale,
-        peso_totale=peso_totale,
+        volume_totale=totali.volume_totale,
+        peso_totale=totali.peso_totale,
+        pages=page_urls(
+            "search",
+            records,
+            has_previous,
+            has_next,
+            **{
+                k: v
+                for k, v in request.args.items()
+                if k not in ("after", "before", "export")
+            },
+        ),
+    )
+
+
+# riepiloghi per gruppo (vedi migrations/0013_summaries.sql)
+SUMMARY_VIEWS = (
+    "inventario_per_responsabile",
+    "inventario_per_gruppo_ricerca",
+    "inventario_per_sipi_torino",
+)
+
+
+def summary_outdated(conn, view: str) -> bool:
+    """
+    True if inventario was modified after the last refresh of the materialized view
+    """
+    if view not in SUMMARY_VIEWS:
+        raise ValueError(f"Riepilogo {view} non valido")
+
+    return conn.execute(
+        text(
+            "SELECT s.version IS DISTINCT FROM v.version "
+            "FROM inventario_version v "
+            "LEFT JOIN inventario_summaries s ON s.view_name = :view"
+        ),
+        {"view": view},
+    ).scalar()
+
+
+def refresh_summary(conn, view: str) -> None:
+    """
+    refresh the materialized view if inventario was modified after the last refresh
+
+    Only one process refreshes the view (advisory lock).
+    """
+    if not summary_outdated(conn, view):
+        return
+
+    if not conn.execute(
+        text("SELECT pg_try_advisory_xact_lock(hashtext(:view))"), {"view": view}
+    ).scalar():
+        conn.rollback()
+        return
+
+    # versione letta prima dell'aggiornamento: la vista contiene almeno queste modifiche
+    version = inventario_version(conn)
+    # le letture della vista non sono bloccate durante l'aggiornamento
+    _ = conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+    _ = conn.execute(
+        text(
+            "INSERT INTO inventario_summaries (view_name, version) "
+            "VALUES (:view, :version) "
+            "ON CONFLICT (view_name) DO UPDATE "
+            "SET version = EXCLUDED.version, refreshed_at = now() "
+            "WHERE inventario_summaries.version < EXCLUDED.version"
+        ),
+        {"view": view, "version": version},
     )
+    conn.commit()
+
+
+def refresh_summaries() -> None:
+    """
+    refresh the outdated materialized views and compact inventario_changes
+    (see migrations/0015_inventario_changes.sql)
+    """
+    with engine.connect() as conn:
+        for view in SUMMARY_VIEWS:
+            refresh_summary(conn, view)
+        _ = conn.execute(text("SELECT compact_inventario_changes()"))
+        conn.commit()
+
+
+# aggiornamento dei riepiloghi fuori dal thread della richiesta
+summary_executor = ThreadPoolExecutor(max_workers=1)
+summary_refresh = {"queued": False}
+
+
+def run_summaries_refresh():
+    summary_refresh["queued"] = False
+    try:
+        refresh_summaries()
+    except Exception:
+        app.logger.exception("Errore nell'aggiornamento dei riepiloghi")
+
+
+def schedule_summaries_refresh():
+    """
+    refresh the materialized views in summary_executor (at most one refresh queued)
+    """
+    if not summary_refresh["queued"]:
+        summary_refresh["queued"] = True
+        _ = summary_executor.submit(run_summaries_refresh)
+
+
+@app.after_request
+def refresh_summaries_after_write(response):
+    # i riepiloghi sono aggiornati dopo le richieste che possono modificare inventario
+    if request.method == "POST" and response.status_code < 400:
+        schedule_summaries_refresh()
+    return response
+
+
+@app.cli.command("aggiorna-riepiloghi")
+def refresh_summaries_command():
+    """
+    refresh the outdated materialized views (e.g. from cron after imports with psql)
+    """
+    refresh_summaries()
 
 
 @app.route(APP_ROOT + "/search_resp")
 @check_login
 def search_resp():
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        # la pagina usa la vista corrente, aggiornata in background
+        if summary_outdated(conn, "inventario_per_responsabile"):
+            schedule_summaries_refresh()
+
         results_responsabili = conn.execute(
             text(
                 (
-                    "SELECT "
-                    "   responsabile_laboratorio, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND NOT collezione "
-                    "          AND da_movimentare "
-                    "          AND NOT trasporto_in_autonomia "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count "
-                    "FROM inventario "
-                    "WHERE responsabile_laboratorio <> '' "
-                    "AND deleted IS NULL "
-                    "GROUP BY responsabile_laboratorio "
-                    "ORDER BY responsabile_laboratorio "
+                    "SELECT r.nome AS responsabile_laboratorio, s.* "
+                    "FROM inventario_per_responsabile s "
+                    "JOIN responsabili r ON r.id = s.responsabile_id "
+                    "ORDER BY r.nome "
                 )
             )
         ).fetchall()
 
         result_senza_responsabile = conn.execute(
-            text(
-                (
-                    "SELECT "
-                    "   responsabile_laboratorio, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND collezione = FALSE "
-                    "          AND da_movimentare = TRUE "
-                    "          AND trasporto_in_autonomia = FALSE "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count "
-                    "FROM inventario "
-                    "WHERE responsabile_laboratorio = '' "
-                    "GROUP BY responsabile_laboratorio "
-                )
-            )
+            text("SELECT * FROM inventario_per_responsabile WHERE responsabile_id = 0")
         ).fetchone()
 
     return render_template(
@@ -1666,52 +2505,21 @@ def search_resp():
 @app.route(APP_ROOT + "/search_gruppo_ricerca")
 @check_login
 def search_gruppo_ricerca():
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        if summary_outdated(conn, "inventario_per_gruppo_ricerca"):
+            schedule_summaries_refresh()
+
         gruppi = conn.execute(
             text(
-                (
-                    "SELECT "
-                    "    gruppo_ricerca, "
-                    "    SUM(quantita) AS n_beni, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND NOT collezione "
-                    "          AND da_movimentare "
-                    "          AND NOT trasporto_in_autonomia "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count "
-                    "FROM inventario "
-                    "WHERE gruppo_ricerca <> '' "
-                    "AND gruppo_ricerca IS NOT NULL "
-                    "AND deleted IS NULL "
-                    "GROUP BY gruppo_ricerca "
-                    "ORDER BY gruppo_ricerca "
-                )
+                "SELECT * FROM inventario_per_gruppo_ricerca "
+                "WHERE gruppo_ricerca <> '' "
+                "ORDER BY gruppo_ricerca"
             )
         ).fetchall()
 
         senza_gruppo = conn.execute(
             text(
-                (
-                    "SELECT "
-                    "    SUM(quantita) AS n_beni, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND NOT collezione "
-                    "          AND da_movimentare "
-                    "          AND NOT trasporto_in_autonomia "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count "
-                    "FROM inventario "
-                    "WHERE (gruppo_ricerca = '' OR gruppo_ricerca IS NULL) "
-                    "AND deleted IS NULL "
-                )
+                "SELECT * FROM inventario_per_gruppo_ricerca WHERE gruppo_ricerca = ''"
             )
         ).fetchone()
 
@@ -1729,49 +2537,28 @@ def search_sipi_torino():
     """
     Show list of clickable SIPI
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
+        if summary_outdated(conn, "inventario_per_sipi_torino"):
+            schedule_summaries_refresh()
+
         results_sipi = conn.execute(
             text(
                 (
-                    "SELECT i.codice_sipi_torino, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND da_movimentare = TRUE "
-                    "          AND trasporto_in_autonomia = FALSE "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count, "
-                    "(SELECT denominazione FROM locali WHERE codice_sipi_torino = i.codice_sipi_torino LIMIT 1) AS denominazione, "
-                    "(SELECT utilizzo FROM locali WHERE codice_sipi_torino = i.codice_sipi_torino LIMIT 1) AS utilizzo "
-                    "FROM inventario i LEFT JOIN locali l ON i.codice_sipi_torino=l.codice_sipi_torino "
-                    "WHERE i.codice_sipi_torino != '' "
-                    "AND i.deleted IS NULL "
-                    "GROUP BY i.codice_sipi_torino "
-                    "ORDER BY i.codice_sipi_torino "
+                    "SELECT s.*, l.denominazione, l.utilizzo "
+                    "FROM inventario_per_sipi_torino s "
+                    "LEFT JOIN LATERAL ("
+                    "    SELECT denominazione, utilizzo FROM locali "
+                    "    WHERE codice_sipi_torino = s.codice_sipi_torino LIMIT 1"
+                    ") l ON TRUE "
+                    "WHERE s.codice_sipi_torino <> '' "
+                    "ORDER BY s.codice_sipi_torino "
                 )
             )
         ).fetchall()
 
         result_senza_sipi = conn.execute(
             text(
-                (
-                    "SELECT codice_sipi_torino, "
-                    "    COUNT(*) FILTER ( "
-                    "        WHERE deleted IS NULL "
-                    "          AND da_movimentare = TRUE "
-                    "          AND trasporto_in_autonomia = FALSE "
-                    "          AND ( "
-                    r"              peso !~ '^-?[0-9]+(\.[0-9]+)?$' "
-                    "              OR dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$' "
-                    "          ) "
-                    "    ) AS invalid_items_count "
-                    "FROM inventario  "
-                    "WHERE codice_sipi_torino = '' "
-                    "AND deleted IS NULL "
-                    "GROUP BY codice_sipi_torino "
-                )
+                "SELECT * FROM inventario_per_sipi_torino WHERE codice_sipi_torino = ''"
             )
         ).fetchone()
 
@@ -1792,16 +2579,307 @@ def search_struttura():
     )
 
 
+def migration_files() -> list[tuple[int, Path]]:
+    """
+    return the migrations (version, file) sorted by version
+
+    The migration files are named <version>_<description>.sql
+    """
+    migrations = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        version, _, _ = path.stem.partition("_")
+        migrations.append((int(version), path))
+    return sorted(migrations)
+
+
+@app.cli.command("migrate")
+@click.option("--fino", type=int, default=None, help="ultima versione da applicare")
+@click.option(
+    "--fake",
+    is_flag=True,
+    help="registra le migrazioni come applicate senza eseguirle "
+    "(database già aggiornato a mano)",
+)
+@click.option("--elenco", is_flag=True, help="mostra lo stato delle migrazioni")
+def migrate(fino: int | None, fake: bool, elenco: bool):
+    """
+    apply the migrations not yet applied (see migrations/)
+
+    Every migration is executed in a single transaction and recorded in
+    schema_migrations. An advisory lock prevents concurrent executions.
+    """
+    with engine.connect() as conn:
+        _ = conn.execute(
+            text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY}
+        )
+        try:
+            _ = conn.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, "
+                    "name TEXT NOT NULL, "
+                    "applied_at TIMESTAMP DEFAULT now())"
+                )
+            )
+            conn.commit()
+
+            applied = dict(
+                conn.execute(
+                    text("SELECT version, applied_at FROM schema_migrations")
+                ).all()
+            )
+            conn.commit()
+
+            for version, path in migration_files():
+                if elenco:
+                    status = (
+                        f"applicata il {applied[version]:%Y-%m-%d %H:%M}"
+                        if version in applied
+                        else "da applicare"
+                    )
+                    print(f"{path.name}: {status}")
+                    continue
+                if version in applied or (fino is not None and version > fino):
+                    continue
+
+                start = time.perf_counter()
+                if not fake:
+                    # cursore psycopg2 senza parametri: :nome e % non sono sostituiti
+                    with conn.connection.cursor() as cursor:
+                        cursor.execute(path.read_text())
+                _ = conn.execute(
+                    text(
+                        "INSERT INTO schema_migrations (version, name) "
+                        "VALUES (:version, :name)"
+                    ),
+                    {"version": version, "name": path.name},
+                )
+                conn.commit()
+                if fake:
+                    print(f"{path.name}: registrata senza esecuzione")
+                else:
+                    print(
+                        f"{path.name}: applicata in {time.perf_counter() - start:.2f} s"
+                    )
+        finally:
+            conn.rollback()
+            _ = conn.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY}
+            )
+            conn.commit()
+
+
+@app.cli.command("crea-partizioni-audit")
+@click.option("--mesi", default=3, help="numero di mesi successivi al corrente")
+def create_audit_partitions(mesi: int):
+    """
+    create the monthly partitions of inventario_audit (see migrations/0008_partition_audit.sql)
+    """
+    with engine.connect() as conn:
+        _ = conn.execute(
+            text("SELECT create_inventario_audit_partitions(:mesi)"), {"mesi": mesi}
+        )
+        conn.commit()
+
+    print(f"Partizioni di inventario_audit create fino a {mesi} mesi dal mese corrente")
+
+
+def audit_archive_path(month) -> Path:
+    """
+    path of the archive file of the audit rows of the month
+    """
+    return (
+        Path(app.config["AUDIT_ARCHIVE_DIR"])
+        / f"inventario_audit_{month:%Y_%m}.jsonl.gz"
+    )
+
+
+@app.cli.command("archivia-audit")
+@click.option(
+    "--mesi", type=int, default=None, help="mesi mantenuti (AUDIT_RETENTION_MONTHS)"
+)
+def archive_audit(mesi: int | None):
+    """
+    move the old audit rows in compressed JSONL files (one for month)
+    """
+    if mesi is None:
+        mesi = app.config["AUDIT_RETENTION_MONTHS"]
+    Path(app.config["AUDIT_ARCHIVE_DIR"]).mkdir(parents=True, exist_ok=True)
+
+    with engine.connect() as conn:
+        months = (
+            conn.execute(
+                text(
+                    "SELECT DISTINCT date_trunc('month', executed_at)::date "
+                    "FROM inventario_audit "
+                    "WHERE executed_at < date_trunc('month', now()) - make_interval(months => :mesi) "
+                    "ORDER BY 1"
+                ),
+                {"mesi": mesi},
+            )
+            .scalars()
+            .all()
+        )
+
+    month_filter = "executed_at >= :month AND executed_at < CAST(:month AS date) + INTERVAL '1 month'"
+    for month in months:
+        archive_path = audit_archive_path(month)
+        temp_path = archive_path.with_name(f".{archive_path.name}")
+
+        with engine.connect() as conn:
+            n = 0
+            with gzip.open(temp_path, "wt", encoding="utf-8") as f_out:
+                # righe dello stesso mese archiviate in precedenza
+                archived_ids = set()
+                if archive_path.exists():
+                    with gzip.open(archive_path, "rt", encoding="utf-8") as f_in:
+                        for line in f_in:
+                            archived_ids.add(json.loads(line)["id"])
+                            _ = f_out.write(line)
+
+                rows = conn.execute(
+                    text(
+                        f"SELECT * FROM inventario_audit WHERE {month_filter} ORDER BY id"
+                    ).execution_options(stream_results=True, yield_per=1000),
+                    {"month": month},
+                ).mappings()
+                for row in rows:
+                    if row["id"] in archived_ids:
+                        continue
+                    _ = f_out.write(
+                        json.dumps(
+                            {**row, "executed_at": row["executed_at"].isoformat()}
+                        )
+                        + "\n"
+                    )
+                    n += 1
+            temp_path.replace(archive_path)
+
+            _ = conn.execute(
+                text(
+                    "INSERT INTO inventario_audit_archivio (record_id, mese) "
+                    "SELECT DISTINCT record_id, :month FROM inventario_audit "
+                    f"WHERE {month_filter} AND record_id IS NOT NULL "
+                    "ON CONFLICT DO NOTHING"
+                ),
+                {"month": month},
+            )
+            # la partizione del mese è eliminata (vedi migrations/0008_partition_audit.sql)
+            partition = f"inventario_audit_{month:%Y_%m}"
+            if conn.execute(text("SELECT to_regclass(:p)"), {"p": partition}).scalar():
+                _ = conn.execute(text(f'DROP TABLE "{partition}"'))
+            else:
+                _ = conn.execute(
+                    text(f"DELETE FROM inventario_audit WHERE {month_filter}"),
+                    {"month": month},
+                )
+            conn.commit()
+
+        print(f"{month:%Y-%m}: {n} righe archiviate in {archive_path}")
+
+
+def archived_audits(record_id: int, months) -> list[dict]:
+    """
+    read the archived audit rows of the record (newest first)
+    """
+    audits = []
+    for month in months:
+        archive_path = audit_archive_path(month)
+        if not archive_path.exists():
+            app.logger.error(f"File di archivio {archive_path} non trovato")
+            continue
+        with gzip.open(archive_path, "rt", encoding="utf-8") as f_in:
+            for line in f_in:
+                audit = json.loads(line)
+                if audit["record_id"] == record_id:
+                    audit["executed_at"] = datetime.fromisoformat(audit["executed_at"])
+                    audits.append(audit)
+
+    return sorted(audits, key=lambda a: (a["executed_at"], a["id"]), reverse=True)
+
+
 @app.route(APP_ROOT + "/storico/<int:record_id>", methods=["GET"])
 @check_login
 def storico(record_id: int):
-    with engine.connect() as conn:
+    with db_connection() as conn:
         sql = text(
-            "SELECT * FROM inventario_audit WHERE record_id = :id ORDER BY executed_at DESC"
+            "SELECT * FROM inventario_audit WHERE record_id = :id "
+            "ORDER BY executed_at DESC, id DESC"
+        )
+        audits = conn.execute(sql, {"id": record_id}).mappings().all()
+
+        current = conn.execute(
+            text("SELECT to_jsonb(i) - 'search_tsv' FROM inventario i WHERE id = :id"),
+            {"id": record_id},
+        ).scalar()
+
+        # mesi archiviati (vedi archive_audit)
+        archived_months = (
+            conn.execute(
+                text(
+                    "SELECT mese FROM inventario_audit_archivio "
+                    "WHERE record_id = :id ORDER BY mese DESC"
+                ),
+                {"id": record_id},
+            )
+            .scalars()
+            .all()
         )
-        audits = conn.execute(sql, {"id": record_id}).fetchall()
 
-    return render_template("storico.html", audits=audits, record_id=record_id)
+    audits = list(audits) + archived_audits(record_id, archived_months)
+
+    return render_template(
+        "storico.html", audits=audit_snapshots(current, audits), record_id=record_id
+    )
+
+
+# colonne derivate da altre colonne, assenti negli audit precedenti alla loro
+# creazione: ricostruite dal record corrente mostrerebbero i valori di oggi.
+# responsabile_id è derivato da responsabile_laboratorio (vedi migrations/0012_responsabili.sql),
+# le altre da peso e dimensioni (vedi migrations/0004_computed_columns.sql)
+AUDIT_IGNORED_FIELDS = (
+    "responsabile_id",
+    "peso_kg",
+    "volume_m3",
+    "peso_non_conforme",
+    "dimensioni_non_conforme",
+    "non_conforme",
+)
+
+
+def without_ignored_fields(data: dict | None) -> dict | None:
+    """
+    returns data without the AUDIT_IGNORED_FIELDS
+    """
+    if data is None:
+        return None
+    return {k: v for k, v in data.items() if k not in AUDIT_IGNORED_FIELDS}
+
+
+def audit_snapshots(current: dict | None, audits) -> list[dict]:
+    """
+    rebuild the complete old/new values of the audit records
+
+    The audit trigger saves only the modified fields of an UPDATE: starting
+    from the current record the history (newest first) is walked backwards
+    applying the differences.
+    AUDIT_IGNORED_FIELDS are removed from the record and from every audit.
+    """
+    state = without_ignored_fields(current) or {}
+    snapshots = []
+    for audit in audits:
+        audit = dict(audit)
+        audit["old_data"] = without_ignored_fields(audit["old_data"])
+        audit["new_data"] = without_ignored_fields(audit["new_data"])
+        if audit["operation_type"] == "DELETE" and audit["old_data"]:
+            state = audit["old_data"]
+        elif audit["operation_type"] == "UPDATE" and audit["new_data"] is not None:
+            audit["new_data"] = {**state, **audit["new_data"]}
+            audit["old_data"] = {**state, **(audit["old_data"] or {})}
+            state = audit["old_data"]
+        snapshots.append(audit)
+
+    return snapshots
 
 
 @app.route(APP_ROOT + "/storico_utente", methods=["GET"])
@@ -1813,7 +2891,7 @@ def storico_utente(email: str = ""):
     if not email:
         flash(f"Utente {email} non trovato", "danger")
         return render_template("storico_utente.html", audit_records=[], username=[])
-    with engine.connect() as conn:
+    with db_connection() as conn:
         sql = text(
             (
                 "SELECT  "
@@ -1838,63 +2916,43 @@ def tutti(mode: str = ""):
     """
     visualizza tutti i beni dell'inventario
     """
-    with engine.connect() as conn:
-        results = conn.execute(
-            text(
-                (
-                    'SELECT id AS "ID", '
-                    'quantita as "Quantità", '
-                    'descrizione_bene AS "Descrizione bene", '
-                    'responsabile_laboratorio AS "Responsabile Laboratorio / Ufficio", '
-                    "COALESCE(gruppo_ricerca, '') AS \"Gruppo ricerca\", "
-                    "da_movimentare, catena_del_freddo, trasporto_in_autonomia, microscopia, alta_specialistica, collezione, "
-                    'codice_sipi_torino AS "Codice SIPI Torino", '
-                    'codice_sipi_grugliasco AS "Codice SIPI Grugliasco", '
-                    'destinazione AS "Destinazione", '
-                    'note AS "Note", '
-                    r"(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$') AS peso_non_conforme, "  #
-                    "(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$') AS dimensioni_non_conforme "
-                    "FROM inventario WHERE deleted IS NULL "
+    if mode == "spreadsheet":
+        with db_connection() as conn:
+            return send_xlsx(
+                conn,
+                text(
+                    f"SELECT {TABLE_COLUMNS} FROM inventario WHERE deleted IS NULL "
                     "ORDER BY responsabile_laboratorio, descrizione_bene, id "
-                )
+                ),
+                {},
+                "togru_tutti_beni.xlsx",
             )
-        )
-        records = results.fetchall()
 
-        columns = results.keys()
-
-    if mode == "spreadsheet":
-        df = pd.DataFrame(records, columns=columns)
-        df = df.drop(columns=["peso_non_conforme", "dimensioni_non_conforme"])
-        df = df.replace({True: "SI", False: "NO"})
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Risultati")
-        output.seek(0)
+    with db_connection() as conn:
+        n_records = conn.execute(
+            text("SELECT COUNT(*) FROM inventario WHERE deleted IS NULL")
+        ).scalar()
 
-        return send_file(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            as_attachment=True,
-            download_name="togru_tutti_beni.xlsx",
+        records, columns, has_previous, has_next = fetch_page(
+            conn,
+            "deleted IS NULL",
+            {},
+            after=request.args.get("after", type=int),
+            before=request.args.get("before", type=int),
         )
-    else:
-        ids = [x[0] for x in records]
 
         # check for doc photo
-        doc_photo = {
-            int(x.stem.split("_")[0]): x.name
-            for x in list(Path(app.config["UPLOAD_FOLDER"]).glob("*_*.*"))
-            if int(x.stem.split("_")[0]) in ids
-        }
+        doc_photo = first_photos(conn, [x[0] for x in records])
 
-        return render_template(
-            "tutti_record.html",
-            records=records,
-            query_string="tutti",
-            columns=columns,
-            doc_photo=doc_photo,
-        )
+    return render_template(
+        "tutti_record.html",
+        n_records=n_records,
+        records=records,
+        query_string="tutti",
+        columns=columns,
+        doc_photo=doc_photo,
+        pages=page_urls("tutti", records, has_previous, has_next),
+    )
 
 
 @app.route(APP_ROOT + "/version")
@@ -1914,7 +2972,7 @@ def view(record_id: int, query_string: str = ""):
     """
     visualizza bene
     """
-    with engine.connect() as conn:
+    with db_connection() as conn:
         sql = text(
             (
                 'SELECT id AS "ID", descrizione_bene AS "Descrizione bene", '
@@ -1937,8 +2995,7 @@ def view(record_id: int, query_string: str = ""):
                 "denominazione_fornitore, anno_fabbricazione, numero_seriale,"
                 "categoria_inventoriale, catalogazione_materiale_strumentazione, peso, dimensioni,"
                 "ditta_costruttrice_fornitrice, note, "
-                r"(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND peso !~ '^-?[0-9]+(\.[0-9]+)?$') AS peso_non_conforme, "  #
-                "(collezione = false AND da_movimentare = true AND trasporto_in_autonomia = false AND dimensioni !~ '^[0-9]+x[0-9]+x[0-9]+$') AS dimensioni_non_conforme "
+                "peso_non_conforme, dimensioni_non_conforme "
                 "FROM inventario "
                 "WHERE id = :id"
             )
@@ -1952,12 +3009,7 @@ def view(record_id: int, query_string: str = ""):
         record_dict["note"] = Markup(record_dict["note"].replace("\r", "<br>"))
 
         # check for doc photo
-        img_list = [
-            x.name
-            for x in sorted(
-                list(Path(app.config["UPLOAD_FOLDER"]).glob(f"{record_id}_*.*"))
-            )
-        ]
+        img_list = record_photos(conn, record_id)
 
     return render_template(
         "view.html", record=record_dict, query_string=query_string, img_list=img_list
@@ -1966,7 +3018,7 @@ def view(record_id: int, query_string: str = ""):
 
 @app.route(APP_ROOT + "/view_qrcode/<int:record_id>")
 def view_qrcode(record_id: int):
-    with engine.connect() as conn:
+    with db_connection() as conn:
         sql = text(("SELECT * FROM inventario WHERE id = :id "))
         result = conn.execute(sql, {"id": record_id}).fetchone()
         if not result:
@@ -1977,5 +3029,214 @@ def view_qrcode(record_id: int):
     return render_template("view.html", record=record_dict, query_string="")
 
 
+# API JSON (v1)
+API_ROOT = APP_ROOT + "/api/v1"
+
+# colonne dei beni restituite da api_search (la prima deve essere id, vedi fetch_page)
+API_SEARCH_COLUMNS = (
+    "id, quantita, descrizione_bene, responsabile_laboratorio, responsabile_id, "
+    "gruppo_ricerca, " + ", ".join(BOOLEAN_FIELDS) + ", "
+    "codice_sipi_torino, codice_sipi_grugliasco, destinazione, note, "
+    "peso, dimensioni, peso_non_conforme, dimensioni_non_conforme"
+)
+
+
+def api_login(f):
+    """
+    as check_login but answers 401 (JSON) instead of redirecting to the login page
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "email" not in session or session["email"] not in authorized_users():
+            return jsonify({"error": "Non autorizzato"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def not_modified(etag: str):
+    """
+    returns a 304 response if the client has the current version (If-None-Match)
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return None
+
+
+def api_response(data, etag: str):
+    """
+    JSON response with ETag: the client must revalidate it at every use
+    """
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def photo_urls(filename: str) -> dict[str, str]:
+    """
+    URL of a photo and of its variants
+    """
+    return {
+        "filename": filename,
+        "url": url_for("static", filename=f"images/{filename}"),
+        **{
+            variant: url_for("static", filename=photo_variant(filename, variant))
+            for variant in PHOTO_VARIANTS
+        },
+    }
+
+
+def record_etag(conn, record_id: int) -> str | None:
+    """
+    version of the record and of its photos, None if the record does not exist
+
+    xmin changes at every UPDATE of the row.
+    """
+    row = conn.execute(
+        text(
+            "SELECT i.xmin::text AS xmin, ("
+            "    SELECT md5(COALESCE(string_agg(filename || ':' || created_at, ',' ORDER BY n), '')) "
+            "    FROM foto WHERE record_id = i.id"
+            ") AS photos "
+            "FROM inventario i WHERE id = :id"
+        ),
+        {"id": record_id},
+    ).fetchone()
+    if row is None:
+        return None
+    return f"record-{record_id}-{row.xmin}-{row.photos[:12]}"
+
+
+@app.route(API_ROOT + "/record/<int:record_id>")
+@api_login
+def api_record(record_id: int):
+    """
+    record with the list of its photos
+    """
+    with db_connection() as conn:
+        etag = record_etag(conn, record_id)
+        if etag is None:
+            return jsonify({"error": f"Bene con ID {record_id} non trovato"}), 404
+        if response := not_modified(etag):
+            return response
+
+        record = (
+            conn.execute(
+                text("SELECT * FROM inventario WHERE id = :id"), {"id": record_id}
+            )
+            .mappings()
+            .one()
+        )
+        photos = record_photos(conn, record_id)
+
+    return api_response(
+        {
+            **{k: v for k, v in record.items() if k != "search_tsv"},
+            "foto": [photo_urls(filename) for filename in photos],
+        },
+        etag,
+    )
+
+
+@app.route(API_ROOT + "/record/<int:record_id>/foto")
+@api_login
+def api_record_photos(record_id: int):
+    """
+    list of the photos of a record
+    """
+    with db_connection() as conn:
+        etag = record_etag(conn, record_id)
+        if etag is None:
+            return jsonify({"error": f"Bene con ID {record_id} non trovato"}), 404
+        if response := not_modified(etag):
+            return response
+
+        photos = record_photos(conn, record_id)
+
+    return api_response([photo_urls(filename) for filename in photos], etag)
+
+
+@app.route(API_ROOT + "/search")
+@api_login
+def api_search():
+    """
+    search with the same filters of search(), paginated with after / before
+    """
+    try:
+        where, params = search_filter(request.args)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    with db_connection() as conn:
+        # ogni modifica di inventario cambia la versione (vedi migrations/0015_inventario_changes.sql)
+        etag = f"search-{inventario_version(conn)}"
+        if response := not_modified(etag):
+            return response
+
+        totali = conn.execute(
+            text(
+                "SELECT "
+                "    COUNT(*) AS n_records, "
+                "    COALESCE(SUM(quantita), 0) AS n_beni, "
+                "    COUNT(*) FILTER (WHERE non_conforme) AS n_beni_non_conformi "
+                f"FROM inventario WHERE {where}"
+            ),
+            params,
+        ).fetchone()
+
+        records, keys, has_previous, has_next = fetch_page(
+            conn,
+            where,
+            params,
+            after=request.args.get("after", type=int),
+            before=request.args.get("before", type=int),
+            columns=API_SEARCH_COLUMNS,
+        )
+
+    return api_response(
+        {
+            **totali._asdict(),
+            "records": [dict(zip(keys, record)) for record in records],
+            "pages": page_urls(
+                "api_search",
+                records,
+                has_previous,
+                has_next,
+                **{
+                    k: v
+                    for k, v in request.args.items()
+                    if k not in ("after", "before")
+                },
+            ),
+        },
+        etag,
+    )
+
+
+@app.route(API_ROOT + "/dashboard")
+def api_dashboard():
+    """
+    statistics of the home page
+    """
+    # le statistiche possono essere quelle precedenti (ricalcolo in corso in un
+    # altro processo): ETag calcolato sul contenuto
+    stats = dashboard_stats()
+    etag = (
+        "dashboard-"
+        + hashlib.md5(json.dumps(stats, sort_keys=True).encode()).hexdigest()[:16]
+    )
+    if response := not_modified(etag):
+        return response
+
+    return api_response(stats, etag)
+
+
 if __name__ == "__main__":
     app.run(debug=True)